@@ -0,0 +1,100 @@
+import json
+import os
+
+
+CATALOG_PATH = os.path.expanduser('~/.cache/qtile/keybindings.tsv')
+
+MODIFIER_LABELS = {
+    'mod1': 'Alt',
+    'mod4': 'Win',
+    'control': 'Ctrl',
+    'shift': 'Shift',
+}
+
+KEY_LABELS = {
+    'Up': '↑',
+    'Down': '↓',
+    'Left': '←',
+    'Right': '→',
+    'grave': '`',
+    'Return': 'Enter',
+}
+
+
+def key_label(modifiers, key):
+    names = [MODIFIER_LABELS.get(modifier, modifier) for modifier in modifiers]
+    key = KEY_LABELS.get(key, key)
+    if names:
+        return '[{} {}]'.format('-'.join(names), key)
+    return '[{}]'.format(key)
+
+
+def _runnable(call):
+    return not call.kwargs and all(isinstance(arg, (str, int, float, bool)) for arg in call.args)
+
+
+def ipc_call(call):
+    # The (selectors, name, args, kwargs) message qtile's IPC server expects.
+    return [[list(selector) for selector in call.selectors], call.name, list(call.args), {}]
+
+
+def _entry(label, desc, commands):
+    if commands and all(_runnable(call) for call in commands):
+        calls = json.dumps([ipc_call(call) for call in commands], ensure_ascii=False)
+    else:
+        calls = ''
+    desc = desc or ' '.join(call.name for call in commands)
+    return (label, desc, calls)
+
+
+def build_catalog(keys, groups=(), mouse=()):
+    entries = [_entry(key_label(key.modifiers, key.key), key.desc, key.commands) for key in keys]
+
+    bound_groups = {
+        str(call.selectors[0][1])
+        for key in keys for call in key.commands
+        if call.name == 'toscreen' and call.selectors and call.selectors[0][0] == 'group'
+    }
+    for group in groups:
+        # Groups without a key binding can still be reached from the catalog.
+        if group.name not in bound_groups:
+            entries.append(('[Group {}]'.format(group.name), 'Switch to group {}'.format(group.name),
+                            json.dumps([[[['group', group.name]], 'toscreen', [], {}]])))
+
+    for binding in mouse:
+        kind = type(binding).__name__
+        desc = '{}: {}'.format(kind, ', '.join(call.name for call in binding.commands))
+        entries.append((key_label(binding.modifiers, binding.button), desc, ''))
+
+    return entries
+
+
+def serialize(entries):
+    # One tab separated line per entry: label, description and the IPC calls
+    # as JSON. The calls are empty for bindings that can not be run from
+    # outside qtile (mouse bindings and non-primitive arguments).
+    return ''.join(
+        '\t'.join(field.replace('\t', ' ').replace('\n', ' ') for field in entry) + '\n'
+        for entry in entries
+    )
+
+
+def write_catalog(keys, groups=(), mouse=(), path=CATALOG_PATH):
+    # Rewrites the catalog only when the bindings changed.
+    data = serialize(build_catalog(keys, groups, mouse))
+    try:
+        with open(path, encoding='utf-8') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+    return True
+
+
+def read_catalog(path=CATALOG_PATH):
+    with open(path, encoding='utf-8') as f:
+        return [tuple(line.rstrip('\n').split('\t')) for line in f if line.strip()]
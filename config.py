@@ -24,18 +24,25 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import os
-import subprocess
+import asyncio
+
+from profiler import profiler
 
 from libqtile.config import Key, Screen, Group, Drag, Click, Match
 from libqtile.lazy import lazy
-from libqtile import layout, bar, widget, hook
+from libqtile import layout, bar, widget, hook, qtile
 from libqtile.widget.backlight import ChangeDirection
 from libqtile.log_utils import logger
 
 from typing import List  # noqa: F401
 
-from mods import lighten, darken, palette, Volume, log_error, execute, ModKeyboardLayout
+from catalog import write_catalog
+from rules import WindowRules, float_rules
+from supervisor import Supervisor, Service, command_succeeds
+
+from mods import lighten, darken, palette, reload_palette, Volume, ModBacklight, ModBattery, log_error, execute, ModKeyboardLayout, TitleTruncator, ModWindowTabs, ModStats, instrument_bar, scheduler
+
+profiler.mark('imports')
 
 
 mod = "mod4"
@@ -63,69 +70,72 @@ Command groups:
 
 keys = [
     # Switch between windows in current stack pane
-    Key([alt], "Up", lazy.layout.up()),
-    Key([alt], "Down", lazy.layout.down()),
-    Key([alt], "Left", lazy.layout.left()),
-    Key([alt], "Right", lazy.layout.right()),
+    Key([alt], "Up", lazy.layout.up(), desc="Focus window above"),
+    Key([alt], "Down", lazy.layout.down(), desc="Focus window below"),
+    Key([alt], "Left", lazy.layout.left(), desc="Focus window left"),
+    Key([alt], "Right", lazy.layout.right(), desc="Focus window right"),
     #Key(['shift'], 'Tab', lazy.layout.next()),
     #Key([alt, 'shift'], 'Tab', lazy.layout.previous()),
 
     # Move windows up or down in current stack
-    Key([mod, alt], "Up", lazy.layout.shuffle_up()),
-    Key([mod, alt], "Down", lazy.layout.shuffle_down()),
-    Key([mod, alt], "m", lazy.layout.swap_main()),
-    Key([mod, alt], "o", lazy.layout.maximize()),
-    Key([mod, alt], "g", lazy.layout.grow()),
-    Key([mod, alt], "s", lazy.layout.shrink()),
+    Key([mod, alt], "Up", lazy.layout.shuffle_up(), desc="Move window up"),
+    Key([mod, alt], "Down", lazy.layout.shuffle_down(), desc="Move window down"),
+    Key([mod, alt], "m", lazy.layout.swap_main(), desc="Set window as main"),
+    Key([mod, alt], "o", lazy.layout.maximize(), desc="Maximize"),
+    Key([mod, alt], "g", lazy.layout.grow(), desc="Grow window size"),
+    Key([mod, alt], "s", lazy.layout.shrink(), desc="Shrink window size"),
 
     # Toggle between different layouts as defined below
-    Key([mod], "Tab", lazy.next_layout()),
-    Key([mod, 'shift'], "Tab", lazy.prev_layout()),
+    Key([mod], "Tab", lazy.next_layout(), desc="Next layout"),
+    Key([mod, 'shift'], "Tab", lazy.prev_layout(), desc="Previous layout"),
 
     # Groups
-    Key([ctrl, alt], 'Right', lazy.screen.next_group()),
-    Key([ctrl, alt], 'Left', lazy.screen.prev_group()),
+    Key([ctrl, alt], 'Right', lazy.screen.next_group(), desc="Next group"),
+    Key([ctrl, alt], 'Left', lazy.screen.prev_group(), desc="Previous group"),
 
     # Qtile commands
-    Key([mod, ctrl], "r", lazy.restart()),
-    Key([mod, ctrl], "q", lazy.shutdown()),
-    Key([mod], "w", lazy.window.kill()),
+    Key([mod, ctrl], "r", lazy.restart(), desc="Restart Qtile"),
+    Key([mod, ctrl], "q", lazy.shutdown(), desc="Quit Qtile"),
+    Key([mod, ctrl], "t", lazy.function(reload_palette), desc="Reload palette"),
+    Key([mod], "w", lazy.window.kill(), desc="Close current window"),
     # Key([ctrl, alt], "l", lazy.spawn("i3lock --color 000000")),
-    Key([ctrl, alt], "l", lazy.spawn("xscreensaver-command -lock")),
-    Key([mod, ctrl], "s", lazy.spawn("mons -s")),
-    Key([mod, ctrl], "p", lazy.spawn("mons -o")),
+    Key([ctrl, alt], "l", lazy.spawn("xscreensaver-command -lock"), desc="Lock screen"),
+    Key([mod, ctrl], "s", lazy.spawn("mons -s"), desc="Secondary monitor only"),
+    Key([mod, ctrl], "p", lazy.spawn("mons -o"), desc="Primary monitor only"),
 
 
     # Custom commands/apps
-    Key([mod], "space", lazy.spawn("rofi -show run")),
-    Key([alt], "grave", lazy.spawn("rofi -show window")),
-    Key([mod], "Return", lazy.spawn("terminator")),
+    Key([mod], "space", lazy.spawn("rofi -show run"), desc="Run a program"),
+    Key([alt], "grave", lazy.spawn("rofi -show window"), desc="Switch window"),
+    Key([mod], "Return", lazy.spawn("terminator"), desc="Open terminal"),
 
     # Show help
-    Key([mod], "h", lazy.spawn("rofi -show 'Key Bindings' -modes \"Key Bindings:/home/pavle/.config/qtile/keybindings.sh\"")),
+    Key([mod], "h", lazy.spawn("rofi -show 'Key Bindings' -modes \"Key Bindings:/home/pavle/.config/qtile/keybindings.sh\""), desc="Show key bindings"),
 
-    Key([], 'XF86AudioRaiseVolume', lazy.widget['mod_volume'].volume_up()),
-    Key([], 'XF86AudioLowerVolume', lazy.widget['mod_volume'].volume_down()),
-    Key([], 'XF86AudioMute', lazy.widget['mod_volume'].toggle_muted()),
-    Key([], 'XF86AudioMicMute', lazy.widget['mod_volume'].toggle_mic_muted()),
-    Key([], 'XF86MonBrightnessDown', lazy.widget['backlight'].change_backlight(ChangeDirection.DOWN)),
-    Key([], 'XF86MonBrightnessUp', lazy.widget['backlight'].change_backlight(ChangeDirection.UP)),
+    Key([], 'XF86AudioRaiseVolume', lazy.widget['mod_volume'].volume_up(), desc="Volume up"),
+    Key([], 'XF86AudioLowerVolume', lazy.widget['mod_volume'].volume_down(), desc="Volume down"),
+    Key([], 'XF86AudioMute', lazy.widget['mod_volume'].toggle_muted(), desc="Toggle mute"),
+    Key([], 'XF86AudioMicMute', lazy.widget['mod_volume'].toggle_mic_muted(), desc="Toggle microphone mute"),
+    Key([], 'XF86MonBrightnessDown', lazy.widget['backlight'].change_backlight(ChangeDirection.DOWN), desc="Brightness down"),
+    Key([], 'XF86MonBrightnessUp', lazy.widget['backlight'].change_backlight(ChangeDirection.UP), desc="Brightness up"),
 
     # Keyboar Layout
-    Key([alt], 'Shift_L', lazy.widget['modkeyboardlayout'].next_keyboard()),
-    Key([alt], 'Shift_R', lazy.widget['modkeyboardlayout'].next_keyboard()),
+    Key([alt], 'Shift_L', lazy.widget['modkeyboardlayout'].next_keyboard(), desc="Next keyboard layout"),
+    Key([alt], 'Shift_R', lazy.widget['modkeyboardlayout'].next_keyboard(), desc="Next keyboard layout"),
 ]
 
 groups = [Group(i) for i in "12345678"]
 for i in groups:
     keys.extend([
         # mod1 + letter of group = switch to group
-        Key([mod], i.name, lazy.group[i.name].toscreen()),
+        Key([mod], i.name, lazy.group[i.name].toscreen(), desc='Switch to group {}'.format(i.name)),
 
         # mod1 + shift + letter of group = switch to & move focused window to group
-        Key([mod, "shift"], i.name, lazy.window.togroup(i.name)),
+        Key([mod, "shift"], i.name, lazy.window.togroup(i.name), desc='Move window to group {}'.format(i.name)),
     ])
 
+profiler.mark('keys and groups')
+
 layouts = [
     layout.Max(),
     layout.MonadTall(
@@ -149,6 +159,12 @@ widget_defaults = dict(
 )
 extension_defaults = widget_defaults.copy()
 
+profiler.mark('layouts')
+profiler.instrument_constructors(
+    widget.GroupBox, ModWindowTabs, widget.Systray, widget.Sep, widget.CurrentLayoutIcon,
+    widget.CurrentLayout, ModBattery, ModBacklight, Volume, ModKeyboardLayout, widget.Clock,
+)
+
 keyboardLayoutWidget = ModKeyboardLayout(
     configured_keyboards = ['us', 'mk'],
     fmt='[⌨  {}]',
@@ -156,118 +172,128 @@ keyboardLayoutWidget = ModKeyboardLayout(
     font='monospace bold',
 )
 
-def parse_text(sep, sel, max_width):
-
-    def _parse_text(text):
-        windows = text.split(sep)
-        result = []
-        for win in windows:
-            if len(win) > max_width:
-                if win.startswith(sel[0]):
-                    win = win.removeprefix(sel[0]).removesuffix(sel[1])
-                    if len(win) > max_width:
-                        win = win[0:max_width-3] + '...'
-                    win = win.join(sel)
-                else:
-                    win = win[0:max_width-3] + '...'
-            result.append(win)
-        return sep.join(result)
-    
-    return _parse_text
-
-screens = [
-    Screen(
-        top=bar.Bar(
-            [
-                widget.GroupBox(
-                    borderwidth=0,
-                    font='monospace',
-                    highlight_method='block',
-                    rounded=False,
-                    active=lighten(palette.foreground, 1),
-                    foreground=palette.foreground,
-                    inactive=palette.foreground,
-                    this_current_screen_border=palette.primary,
-                    margin_y=2,
-                ),
-                # widget.TaskList(
-                #     background=palette.background,
-                #     highlight_method='block',
-                #     border=darken(palette.primary, 0.4),
-                #     foreground=lighten(palette.foreground, 0.5),
-                #     borderwidth=0,
-                #     max_title_width=200,
-                #     rounded=False,
-                #     urgent_alert_method='block',
-                #     urgent_border=palette.danger,
-                #     #padding_y=0,
-                #     margin_y=0,
-                #     icon_size=14,
-                #     font='monospace',
-                # ),
-                widget.WindowTabs(
-                    background=palette.background,
-                    foreground=lighten(palette.foreground, 0.5),
-                    font='monospace',
-                    separator=' || ',
-                    selected=('<span color="black" bgcolor="#feecee">', '</span>'),
-                    parse_text=parse_text(' || ', ('<span color="black" bgcolor="#feecee">', '</span>'), 35),
-                ),
-                widget.Systray(),
-                widget.Sep(
-                    size_percent=100,
-                    padding=5,
-                    linewidth=0,
-                    background=palette.background,
-                    foreground=darken(palette.background, 0.5),
-                ),
-                widget.CurrentLayoutIcon(
-                    background=darken(palette.background, 0.5),
-                    scale=0.6,
-                    font='monospace',
-                ),
-                widget.CurrentLayout(
-                    background=darken(palette.background, 0.5),
-                    font='monospace',
-                ),
-                widget.Battery(
-                    fmt='[{}]',
-                    format='⚡ {percent:2.0%} {char}',
-                    charge_char='⇧',
-                    discharge_char='⇩',
-                    empty_char='☠',
-                    background=darken(palette.background, 0.5),
-                ),
-                widget.Backlight(
-                    backlight_name='intel_backlight',
-                    change_command='brightnessctl s {0}%',
-                    step=5,
-                    format='[💡 {percent:2.0%}]',
-                    background=darken(palette.background, 0.5),
-                    font='monospace bold',
-                ),
-                Volume(
-                    background=darken(palette.background, 0.5),
-                    font='monospace bold',
-                ),
-                #widget.KeyboardLayout(
-                keyboardLayoutWidget,
-                widget.Clock(
-                    format='[ %Y-%m-%d %a %I:%M:%S %p ]',
-                    foreground=palette.background,
-                    background=palette.foreground,#darken(palette.background, 0.5),
-                    font='monospace bold',
-                ),
-            ],
-            20,
-            **{
-                'background': palette.background,
-                'fontsize': 20,
-                'font':'monospace',
-            },
-        ),
-    ),
-]
+audioMixerMatch = Match(wm_class='pavucontrol')
+
+windowTabsSeparator = ' || '
+windowTabsSelected = ('<span color="black" bgcolor="#feecee">', '</span>')
+
+# Widgets that only make sense once, they live on the primary screen's bar and
+# are reused when the outputs change.
+systrayWidget = widget.Systray()
+
+batteryWidget = ModBattery(
+    fmt='[{}]',
+    format='⚡ {percent:2.0%} {char}',
+    charge_char='⇧',
+    discharge_char='⇩',
+    empty_char='☠',
+    background=darken(palette.background, 0.5),
+)
+
+backlightWidget = ModBacklight(
+    backlight_name='intel_backlight',
+    change_command='brightnessctl s {0}%',
+    step=5,
+    format='[💡 {percent:2.0%}]',
+    background=darken(palette.background, 0.5),
+    font='monospace bold',
+)
+
+volumeWidget = Volume(
+    subscribe=True,
+    audio_mixer_match=audioMixerMatch,
+    background=darken(palette.background, 0.5),
+    font='monospace bold',
+)
+
+statsWidget = ModStats()
+
+
+def make_bar(primary):
+    return bar.Bar(
+        [
+            widget.GroupBox(
+                borderwidth=0,
+                font='monospace',
+                highlight_method='block',
+                rounded=False,
+                active=lighten(palette.foreground, 1),
+                foreground=palette.foreground,
+                inactive=palette.foreground,
+                this_current_screen_border=palette.primary,
+                margin_y=2,
+            ),
+            # widget.TaskList(
+            #     background=palette.background,
+            #     highlight_method='block',
+            #     border=darken(palette.primary, 0.4),
+            #     foreground=lighten(palette.foreground, 0.5),
+            #     borderwidth=0,
+            #     max_title_width=200,
+            #     rounded=False,
+            #     urgent_alert_method='block',
+            #     urgent_border=palette.danger,
+            #     #padding_y=0,
+            #     margin_y=0,
+            #     icon_size=14,
+            #     font='monospace',
+            # ),
+            ModWindowTabs(
+                background=palette.background,
+                foreground=lighten(palette.foreground, 0.5),
+                font='monospace',
+                separator=windowTabsSeparator,
+                selected=windowTabsSelected,
+                parse_text=TitleTruncator(windowTabsSeparator, windowTabsSelected, 250),
+            ),
+            *([systrayWidget] if primary else []),
+            widget.Sep(
+                size_percent=100,
+                padding=5,
+                linewidth=0,
+                background=palette.background,
+                foreground=darken(palette.background, 0.5),
+            ),
+            widget.CurrentLayoutIcon(
+                background=darken(palette.background, 0.5),
+                scale=0.6,
+                font='monospace',
+            ),
+            widget.CurrentLayout(
+                background=darken(palette.background, 0.5),
+                font='monospace',
+            ),
+            #widget.KeyboardLayout(
+            *([batteryWidget, backlightWidget, volumeWidget, keyboardLayoutWidget] if primary else []),
+            scheduler.adopt(widget.Clock(
+                format='[ %Y-%m-%d %a %I:%M:%S %p ]',
+                foreground=palette.background,
+                background=palette.foreground,#darken(palette.background, 0.5),
+                font='monospace bold',
+            )),
+            *([statsWidget] if primary else []),
+        ],
+        20,
+        **{
+            'background': palette.background,
+            'fontsize': 20,
+            'font':'monospace',
+        },
+    )
+
+
+def make_screen(index):
+    # The first screen is the one qtile puts on the first output, it always
+    # gets the bar with the singleton widgets.
+    screen = Screen(top=make_bar(primary=index == 0))
+    instrument_bar(screen.top, 'screen{}'.format(index))
+    return screen
+
+
+screens = [make_screen(0)]
+profiler.instrument_first_draw(screens[0].top)
+
+profiler.mark('screens')
 
 # Drag floating layouts.
 mouse = [
@@ -278,23 +304,84 @@ mouse = [
     Click([mod], "Button2", lazy.window.bring_to_front())
 ]
 
+write_catalog(keys, groups, mouse)
+
+profiler.mark('catalog')
+
+touchpad = 'SynPS/2 Synaptics TouchPad'
+
+# startup_complete already means the WM and its systray are up, which is what
+# the old `sleep 3` before alttab was waiting for.
+autostart_services = [
+    Service('nitrogen', ['nitrogen', '--restore'], oneshot=True),
+    Service('xscreensaver', ['xscreensaver', '--no-splash'],
+            ready=command_succeeds('xscreensaver-command', '-version')),
+    # Enable touchpad tap to click
+    Service('touchpad-tap', ['xinput', 'set-prop', touchpad, 'libinput Tapping Enabled', '1'], oneshot=True),
+    Service('touchpad-prop-300', ['xinput', 'set-prop', touchpad, '300', '1'], oneshot=True),
+    Service('touchpad-prop-324', ['xinput', 'set-prop', touchpad, '324', '0.5'], oneshot=True),
+    Service('blueman-applet', ['blueman-applet']),
+    Service('nm-applet', ['nm-applet']),
+    Service('parcellite', ['parcellite']),
+    Service('terminator', ['terminator']),
+    # Sane alt-tab behaviour
+    Service('alttab', ['alttab', '-fg', '#52baff', '-bg', '#4a4a4a', '-frame', '#52baff',
+                       '-t', '128x150', '-i', '127x64']),
+]
+
 # Hooks
 @hook.subscribe.startup_complete
 @log_error
 def autostart():
-    home = os.path.expanduser('~/.config/qtile/scripts/autostart.sh')
-    subprocess.call(['bash',  home])
+    asyncio.ensure_future(Supervisor(autostart_services).start())
+    scheduler.watch_screensaver()
+    # Runs after qtile adopted the windows that survived a restart.
+    keyboardLayoutWidget.cmd_forget_closed_windows()
+    # Outputs beyond the first came up without a bar.
+    if add_screens():
+        qtile.cmd_reconfigure_screens()
+    profiler.write()
 
 #@hook.subscribe.startup
 #def startup():
 #    execute("xrandr", "--output", "DP-1", "--primary")
 #    execute("xrandr", "--output", "eDP-1", "--off")
 
+def add_screens():
+    # Adds a screen for every output beyond the configured ones. Existing
+    # screens keep their bars and widgets, screens without an output keep
+    # theirs for when it comes back.
+    outputs = len(qtile.core.get_screen_info())
+    added = False
+    while len(qtile.config.screens) < outputs:
+        qtile.config.screens.append(make_screen(len(qtile.config.screens)))
+        added = True
+    return added
+
+@hook.subscribe.screen_change
+@log_error
+def on_screen_change(event):
+    # Only bars whose output geometry changed are laid out again.
+    add_screens()
+    qtile.cmd_reconfigure_screens()
+
+@hook.subscribe.client_new
+@log_error
+def on_window_new(client):
+    window_rules.place(client)
+
 @hook.subscribe.client_focus
 @log_error
 def on_window_focus(client):
     keyboardLayoutWidget.cmd_window_focus(client)
 
+@hook.subscribe.client_killed
+@log_error
+def on_window_killed(client):
+    keyboardLayoutWidget.cmd_window_killed(client)
+
+profiler.mark('hooks')
+
 
 dgroups_key_binder = None
 dgroups_app_rules = []  # type: List
@@ -302,19 +389,26 @@ main = None
 follow_mouse_focus = True
 bring_front_click = False
 cursor_warp = False
-floating_layout = layout.Floating(float_rules=[
+window_rules = WindowRules([
     # Run the utility of `xprop` to see the wm class and name of an X client.
-        *layout.Floating.default_float_rules,
+    *float_rules(layout.Floating.default_float_rules),
+    *float_rules([
         Match(wm_class="confirmreset"),  # gitk
         Match(wm_class="makebranch"),  # gitk
         Match(wm_class="maketag"),  # gitk
         Match(wm_class="ssh-askpass"),  # ssh-askpass
         Match(title="branchdialog"),  # gitk
         Match(title="pinentry"),  # GPG key password entry
-        Match(wm_class='pavucontrol'),
+        audioMixerMatch,
+    ]),
+    # Placement rules need "from rules import WindowRule", e.g.
+    # WindowRule(Match(wm_class="firefox"), group="2", layout="max"),
 ])
+floating_layout = layout.Floating(float_rules=[window_rules.float_match])
 auto_fullscreen = True
 focus_on_window_activation = "smart"
+# on_screen_change() reconfigures the screens itself after adding new ones.
+reconfigure_screens = False
 
 # XXX: Gasp! We're lying here. In fact, nobody really uses or cares about this
 # string besides java UI toolkits; you can see several discussions on the
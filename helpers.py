@@ -0,0 +1,404 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from subprocess import PIPE, DEVNULL
+
+
+# The helpers used by the widgets in mods.py that do not need qtile itself.
+# They log through qtile's logger.
+logger = logging.getLogger('libqtile')
+
+
+class CommandUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Stops calling a binary after `threshold` consecutive failures (timeouts,
+    # missing binary) for a backoff period that doubles on every failed retry.
+
+    def __init__(self, threshold=3, backoff=5.0, max_backoff=300.0, clock=time.monotonic):
+        self.threshold = threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self._failures = {}
+        self._open_until = {}
+
+    def check(self, name):
+        open_until = self._open_until.get(name)
+        if open_until is not None and self.clock() < open_until:
+            raise CommandUnavailable('{} is unavailable for another {:.1f}s'.format(
+                name, open_until - self.clock()))
+
+    def success(self, name):
+        self._failures.pop(name, None)
+        self._open_until.pop(name, None)
+
+    def failure(self, name):
+        failures = self._failures.get(name, 0) + 1
+        self._failures[name] = failures
+        if failures >= self.threshold:
+            backoff = min(self.backoff * 2 ** (failures - self.threshold), self.max_backoff)
+            self._open_until[name] = self.clock() + backoff
+            logger.warning('%s failed %d times, not calling it for %.1fs', name, failures, backoff)
+
+
+class StepCoalescer:
+    # Merges the steps pushed within `window` seconds into one net delta so a
+    # burst of key repeats results in a single apply. `on_pending` is called
+    # right away with the accumulated delta so the widget can show the target.
+
+    def __init__(self, apply, on_pending=None, window=0.15, call_later=None):
+        self.apply = apply
+        self.on_pending = on_pending
+        self.window = window
+        self.pending = 0
+        self._call_later = call_later
+        self._handle = None
+
+    def push(self, delta):
+        self.pending += delta
+        if self.on_pending:
+            self.on_pending(self.pending)
+        if self._handle is None:
+            call_later = self._call_later or asyncio.get_event_loop().call_later
+            self._handle = call_later(self.window, self.flush)
+
+    def flush(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        delta, self.pending = self.pending, 0
+        if delta:
+            self.apply(delta)
+
+
+async def xscreensaver_watch():
+    process = await asyncio.create_subprocess_exec(
+        'xscreensaver-command', '-watch', stdout=PIPE, stderr=DEVNULL)
+    try:
+        async for line in process.stdout:
+            yield line.decode('utf-8')
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+
+class ScheduledCall:
+
+    def __init__(self, fn, interval, due):
+        self.fn = fn
+        self.interval = interval
+        self.due = due
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TickScheduler:
+    # Runs widget updates on shared ticks aligned to `resolution` seconds of
+    # wall clock time, so timers that fall due close together wake the loop
+    # once. Text set through update() is drawn at the end of the tick like
+    # _TextBox.update would, the widget alone when its width is unchanged,
+    # otherwise its bar, once per tick. Updates from outside a tick wait for
+    # the next one. While xscreensaver has the screen locked or blanked, ticks
+    # are aligned to `locked_interval` instead and periodic updates run at
+    # most that often.
+
+    def __init__(self, resolution=1.0, locked_interval=60, clock=time.time):
+        self.resolution = resolution
+        self.locked_interval = locked_interval
+        self.clock = clock
+        self.locked = False
+        self._calls = []
+        self._handle = None
+        self._handle_due = None
+        self._watch = None
+        self._pending = {}
+        self._flush = None
+        self._running = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.started = self.clock()
+        self.wakeups = 0
+        self.runs = 0
+        self.bar_draws = 0
+        self.widget_draws = 0
+        self.locked_seconds = 0.0
+        self._locked_since = self.started if self.locked else None
+
+    def _align(self, t):
+        step = self.locked_interval if self.locked else self.resolution
+        return math.ceil(t / step - 1e-6) * step
+
+    def _interval(self, call):
+        if self.locked:
+            return max(call.interval, self.locked_interval)
+        return call.interval
+
+    def call_later(self, seconds, fn):
+        if seconds <= 0:
+            call = ScheduledCall(fn, None, 0)
+            asyncio.get_event_loop().call_soon(self._run_now, call)
+            return call
+        call = ScheduledCall(fn, None, self._align(self.clock() + seconds))
+        self._calls.append(call)
+        self._arm()
+        return call
+
+    def call_every(self, interval, fn):
+        call = ScheduledCall(fn, interval, self._align(self.clock() + interval))
+        self._calls.append(call)
+        self._arm()
+        return call
+
+    def update(self, widget, text):
+        # Stands in for widget.update(text).
+        self._pending[widget] = text
+        if self._running:
+            return
+        if self._flush is None or self._flush.cancelled:
+            self._flush = ScheduledCall(lambda: None, None, self._align(self.clock()))
+            self._calls.append(self._flush)
+            self._arm()
+
+    def update_now(self, widget, text):
+        # For direct feedback to a key press, replaces a pending update.
+        self._pending.pop(widget, None)
+        widget.update(text)
+
+    def adopt(self, widget):
+        # Takes over the timer of a polling widget (InLoopPollText): the text
+        # is refreshed from poll() on the shared ticks.
+        def timer_setup():
+            widget.tick()
+            if widget.update_interval:
+                self.call_every(widget.update_interval, lambda: self._poll_widget(widget))
+
+        widget.timer_setup = timer_setup
+        return widget
+
+    def _poll_widget(self, widget):
+        # Bars of screens without an output have no window until it returns.
+        if getattr(widget.bar, 'window', None) is None:
+            return
+        text = widget.poll()
+        if text is not None:
+            self.update(widget, text)
+
+    def _run_now(self, call):
+        if not call.cancelled:
+            self._run([call])
+
+    def _run(self, calls):
+        self._running = True
+        try:
+            for call in calls:
+                self.runs += 1
+                try:
+                    call.fn()
+                except Exception as e:
+                    logger.exception(e)
+        finally:
+            self._running = False
+        self._draw_pending()
+
+    def _draw_pending(self):
+        pending, self._pending = self._pending, {}
+        if self._flush is not None:
+            self._flush.cancel()
+            self._flush = None
+        bars = set()
+        widgets = []
+        for widget, text in pending.items():
+            if text is None:
+                text = ''
+            if text == widget.text:
+                continue
+            layout = getattr(widget, 'layout', None)
+            width = layout.width if layout is not None else None
+            widget.text = text
+            if getattr(widget.bar, 'window', None) is None:
+                continue
+            if layout is not None and layout.width == width:
+                widgets.append(widget)
+            else:
+                bars.add(widget.bar)
+        for bar in bars:
+            self.bar_draws += 1
+            bar.draw()
+        for widget in widgets:
+            if widget.bar not in bars:
+                self.widget_draws += 1
+                widget.draw()
+
+    def _arm(self):
+        self._calls = [call for call in self._calls if not call.cancelled]
+        due = min((call.due for call in self._calls), default=None)
+        if due == self._handle_due:
+            return
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        self._handle_due = due
+        if due is not None:
+            delay_secs = max(0, due - self.clock())
+            self._handle = asyncio.get_event_loop().call_later(delay_secs, self._wake)
+
+    def _wake(self):
+        self._handle = None
+        self._handle_due = None
+        self.wakeups += 1
+        now = self.clock()
+        due = [call for call in self._calls if not call.cancelled and call.due <= now + 0.01]
+        for call in due:
+            if call.interval is None:
+                call.cancel()
+            else:
+                call.due = self._align(max(call.due + self._interval(call), now))
+        self._run(due)
+        self._arm()
+
+    def set_locked(self, locked):
+        if locked == self.locked:
+            return
+        now = self.clock()
+        self.locked = locked
+        if locked:
+            self._locked_since = now
+            for call in self._calls:
+                call.due = self._align(max(call.due, now))
+        else:
+            self.locked_seconds += now - self._locked_since
+            self._locked_since = None
+            # Catch up right away, the clock has been stale for up to a minute.
+            for call in self._calls:
+                call.due = min(call.due, self._align(now))
+        self._arm()
+
+    def watch_screensaver(self, event_source=xscreensaver_watch):
+        if self._watch is None or self._watch.done():
+            self._watch = asyncio.ensure_future(self._follow_screensaver(event_source))
+
+    async def _follow_screensaver(self, event_source):
+        # xscreensaver-command exits when xscreensaver is not (yet) running,
+        # retry with a growing pause but give up when it is not installed.
+        retry = 5
+        while True:
+            try:
+                async for line in event_source():
+                    retry = 5
+                    event = line.split()[0] if line.strip() else ''
+                    if event in ('LOCK', 'BLANK'):
+                        self.set_locked(True)
+                    elif event == 'UNBLANK':
+                        self.set_locked(False)
+            except FileNotFoundError:
+                logger.info('xscreensaver-command not found, not backing off while locked')
+                return
+            self.set_locked(False)
+            await asyncio.sleep(retry)
+            retry = min(retry * 2, 600)
+
+    def stats(self):
+        now = self.clock()
+        minutes = max(now - self.started, 1e-9) / 60
+        locked_seconds = self.locked_seconds
+        if self._locked_since is not None:
+            locked_seconds += now - self._locked_since
+        # Without the scheduler every run was a wakeup and a draw of its own.
+        return {
+            'seconds': now - self.started,
+            'locked_seconds': locked_seconds,
+            'scheduled': len([call for call in self._calls if not call.cancelled]),
+            'wakeups_per_minute_before': self.runs / minutes,
+            'wakeups_per_minute_after': self.wakeups / minutes,
+            'bar_draws_per_minute': self.bar_draws / minutes,
+            'widget_draws_per_minute': self.widget_draws / minutes,
+        }
+
+
+class KeyboardLayoutStore:
+    # Append-only log of "<kind>\t<key>\t<layout>" lines where kind is "w" for
+    # a window id or "c" for a wm_class, an empty layout removes the key. The
+    # log is replayed into two dicts on load and rewritten once it gets long.
+
+    def __init__(self, path, compact_after=500):
+        self.path = path
+        self.compact_after = compact_after
+        self.windows = {}
+        self.classes = {}
+        self._lines = 0
+        self._load()
+
+    def _table(self, kind):
+        return self.windows if kind == 'w' else self.classes
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        for line in data.splitlines():
+            fields = line.split('\t')
+            if len(fields) != 3:
+                continue
+            kind, key, layout = fields
+            if layout:
+                self._table(kind)[key] = layout
+            else:
+                self._table(kind).pop(key, None)
+            self._lines += 1
+
+    def lookup(self, wid, wm_class=None):
+        return self.windows.get(str(wid)) or (wm_class and self.classes.get(wm_class))
+
+    def remember(self, wid, wm_class, layout):
+        entries = [('w', str(wid), layout)]
+        if wm_class:
+            entries.append(('c', wm_class, layout))
+        self._append(entries)
+
+    def forget_window(self, wid):
+        if str(wid) in self.windows:
+            self._append([('w', str(wid), '')])
+
+    def retain_windows(self, wids):
+        # Window ids are reused by the next X session, keep only live ones.
+        wids = {str(wid) for wid in wids}
+        stale = [wid for wid in self.windows if wid not in wids]
+        for wid in stale:
+            del self.windows[wid]
+        if stale:
+            self.compact()
+
+    def _append(self, entries):
+        for kind, key, layout in entries:
+            if layout:
+                self._table(kind)[key] = layout
+            else:
+                self._table(kind).pop(key, None)
+        if self._lines + len(entries) > self.compact_after:
+            self.compact()
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.writelines('{}\t{}\t{}\n'.format(*entry) for entry in entries)
+        self._lines += len(entries)
+
+    def compact(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for kind in 'wc':
+                for key, layout in self._table(kind).items():
+                    f.write('{}\t{}\t{}\n'.format(kind, key, layout))
+        os.replace(tmp_path, self.path)
+        self._lines = len(self.windows) + len(self.classes)
@@ -0,0 +1,96 @@
+import json
+import marshal
+import os
+import socket
+import struct
+import sys
+
+
+# Framing used by libqtile.ipc: a 4 byte big endian length and a marshal body.
+HDRFORMAT = '!L'
+HDRLEN = struct.calcsize(HDRFORMAT)
+
+SUCCESS = 0
+
+
+class IPCError(Exception):
+    pass
+
+
+def find_sockfile(display=None):
+    display = display or os.environ.get('WAYLAND_DISPLAY') or os.environ.get('DISPLAY') or ''
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_dir, 'qtile', 'qtilesocket.{}'.format(display))
+
+
+def pack(msg):
+    body = marshal.dumps(msg)
+    return struct.pack(HDRFORMAT, len(body)) + body
+
+
+def unpack(data):
+    if len(data) < HDRLEN:
+        raise IPCError('Short reply from qtile')
+    size, = struct.unpack(HDRFORMAT, data[:HDRLEN])
+    return marshal.loads(data[HDRLEN:HDRLEN + size])
+
+
+class QtileClient:
+    # Speaks qtile's IPC protocol directly, so sending a command does not have
+    # to start `qtile cmd-obj` and import libqtile. The server answers one
+    # message per connection and handles connections concurrently, so
+    # call_many() waits for each reply before sending the next call; later
+    # calls may depend on earlier ones, e.g. toscreen before focus.
+
+    def __init__(self, sockfile=None, timeout=2.0):
+        self.sockfile = sockfile or find_sockfile()
+        self.timeout = timeout
+
+    def _send(self, call):
+        selectors, name, args, kwargs = call
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.sockfile)
+            sock.sendall(pack(([tuple(selector) for selector in selectors], name, tuple(args), kwargs)))
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _receive(self, sock):
+        chunks = []
+        with sock:
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        status, result = unpack(b''.join(chunks))
+        if status != SUCCESS:
+            raise IPCError(result)
+        return result
+
+    def call(self, selectors, name, *args, **kwargs):
+        return self._receive(self._send((selectors, name, args, kwargs)))
+
+    def call_many(self, calls):
+        return [self._receive(self._send(call)) for call in calls]
+
+
+def dispatch(calls, client=None):
+    # `calls` as stored in the key bindings catalog: a JSON list of
+    # [selectors, name, args, kwargs].
+    if isinstance(calls, str):
+        calls = json.loads(calls)
+    return (client or QtileClient()).call_many(calls)
+
+
+if __name__ == '__main__':
+    try:
+        for calls in sys.argv[1:]:
+            dispatch(calls)
+    except (OSError, IPCError) as e:
+        print('qtile IPC failed: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
@@ -1,17 +1,70 @@
+import asyncio
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import os
+import re
+import socket
+import struct
+import time
+from bisect import bisect_left
+from collections import namedtuple
 from colorsys import rgb_to_hls, hls_to_rgb
 from types import SimpleNamespace
-from libqtile.widget import base, KeyboardLayout
+from libqtile.widget import base, KeyboardLayout, WindowTabs
+from libqtile.widget.backlight import ChangeDirection
 from libqtile.lazy import lazy
 from libqtile import bar
+from libqtile.config import Match
 from libqtile.log_utils import logger
-from subprocess import Popen, PIPE
-from threading import Timer
-from functools import wraps
+from subprocess import Popen, PIPE, DEVNULL, TimeoutExpired
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps, lru_cache
+from html import unescape
+from xml.sax.saxutils import escape
+
+from helpers import CommandUnavailable, CircuitBreaker, StepCoalescer, TickScheduler, KeyboardLayoutStore
+from sysfs import read_sysfs, read_sysfs_int, read_battery, BatteryIntervals, BacklightLevel
+from profiler import profiler
 
 SPEAKER_LEVELS = '🔈🔉🔊'
 SPEAKER_MUTED = '🔇'
 MIC_MUTED = '🎙'
 
+# Lines emitted by `pactl subscribe`, e.g. "Event 'change' on sink #0"
+PULSE_EVENT_RE = re.compile(r"^Event '(?P<event>[\w-]+)' on (?P<facility>[\w-]+)(?: #(?P<index>\d+))?$")
+PULSE_FACILITY_FACETS = {
+    'sink': {'volume', 'muted'},
+    'source': {'mic_muted'},
+    'server': {'volume', 'muted', 'mic_muted'},
+}
+
+VOLUME_FACETS = ('volume', 'muted', 'mic_muted')
+VolumeState = namedtuple('VolumeState', [*VOLUME_FACETS, 'stale'], defaults=(False,))
+
+# Seconds an external command may run before it is killed
+COMMAND_TIMEOUT = 2.0
+
+# Optional palette overrides, also read by reload_palette()
+PALETTE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'palette.json')
+
+# lighten()/darken() factors precompiled for every palette color
+THEME_FACTORS = tuple(n / 10 for n in range(1, 11))
+THEME_CACHE_DIR = os.path.expanduser('~/.cache/qtile')
+
+# Call latency collected by log_error, see ModStats.cmd_call_stats
+INSTRUMENT_CALLS = True
+SLOW_CALL_THRESHOLD = 0.02
+CALL_HISTOGRAM_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# Read by ModBacklight and ModBattery, tests point sysfs_root at a fake tree
+SYSFS_ROOT = '/sys'
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+INOTIFY_EVENT = struct.Struct('iIII')
+NETLINK_KOBJECT_UEVENT = 15
+
 # Color helpers
 def hex_to_rgb(hex):
     if not hex:
@@ -21,7 +74,7 @@ def hex_to_rgb(hex):
     if len(hex) not in [3,6]:
         raise Exception('Invalid color: ' + hex)
     if len(hex) == 3:
-        hex = [c + '0' for c in hex]
+        hex = ''.join([c * 2 for c in hex])
     return tuple([int(hex[n:n+2], 16) for n in [0,2,4]])
 
 
@@ -29,19 +82,88 @@ def rgb_to_hex(r,g,b):
     return '#' + ''.join(['%02x'%c for c in [r,g,b]])
 
 
-def adjust_color_lightness(color, p):
+def gradient(color, multipliers):
+    # Derives all lightness multipliers of a color from a single HLS conversion.
     r, g, b = hex_to_rgb(color)
     h, l, s = rgb_to_hls(r/255, g/255, b/255)
-    l = max(min(l*p, 1.0), 0.0)
-    color = rgb_to_hex(*tuple([int(c * 255) for c in hls_to_rgb(h, l, s)]))
-    return color
+    return [
+        rgb_to_hex(*tuple([int(c * 255) for c in hls_to_rgb(h, max(min(l*p, 1.0), 0.0), s)]))
+        for p in multipliers
+    ]
+
+
+# Derived colors keyed by "<color> <multiplier>", filled by compile_theme()
+_derived_colors = {}
+
+
+@lru_cache(maxsize=None)
+def adjust_color_lightness(color, p):
+    derived = _derived_colors.get('{} {:g}'.format(color, p))
+    if derived is not None:
+        return derived
+    return gradient(color, [p])[0]
+
+
+class ThemeColor(str):
+    # A color that remembers which palette entry and lightness adjustments it
+    # was derived from, so it can be recomputed when the palette changes.
+
+    def __new__(cls, value, name, adjustments=()):
+        color = super().__new__(cls, value)
+        color.name = name
+        color.adjustments = adjustments
+        return color
+
+    def adjusted(self, p):
+        return ThemeColor(adjust_color_lightness(str(self), p), self.name, self.adjustments + (p,))
+
+    def resolve(self, palette):
+        color = getattr(palette, self.name)
+        for p in self.adjustments:
+            color = color.adjusted(p)
+        return color
+
+
+def _adjust(color, p):
+    if isinstance(color, ThemeColor):
+        return color.adjusted(p)
+    return adjust_color_lightness(color, p)
 
 
 def lighten(color, factor=0.1):
-    return adjust_color_lightness(color, 1 + factor)
+    return _adjust(color, 1 + factor)
 
 def darken(color, factor=0.1):
-    return adjust_color_lightness(color, 1 - factor)
+    return _adjust(color, 1 - factor)
+
+
+def compile_theme(palette, factors=THEME_FACTORS, cache_dir=THEME_CACHE_DIR):
+    # Expands every palette color into its lighten/darken variants. The table is
+    # cached on disk keyed by a hash of the palette so a config reload only
+    # loads it.
+    colors = sorted(set(vars(palette).values()))
+    multipliers = sorted({1 + f for f in factors} | {1 - f for f in factors})
+    digest = hashlib.sha1(json.dumps([colors, multipliers]).encode('utf-8')).hexdigest()[:16]
+    cache_path = os.path.join(cache_dir, 'theme-{}.json'.format(digest))
+
+    try:
+        with open(cache_path) as f:
+            table = json.load(f)
+    except (OSError, ValueError):
+        table = {}
+        for color in colors:
+            for p, derived in zip(multipliers, gradient(color, multipliers)):
+                table['{} {:g}'.format(color, p)] = derived
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(cache_path + '.tmp', 'w') as f:
+                json.dump(table, f)
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError as e:
+            logger.warning('Could not cache theme: %s', e)
+
+    _derived_colors.update(table)
+    return table
 
 # palette = SimpleNamespace(
 #     primary='#2c5182',
@@ -66,27 +188,377 @@ palette = SimpleNamespace(
 )
 
 
-def log_error(fn):
+def set_palette_colors(palette, colors):
+    for name, color in colors.items():
+        setattr(palette, name, ThemeColor(color, name))
+    compile_theme(palette)
+
+
+def read_palette_file(path=PALETTE_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        logger.warning('Ignoring malformed palette file %s: %s', path, e)
+        return {}
+
+
+set_palette_colors(palette, {**vars(palette), **read_palette_file()})
+
+
+class CallStats:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.histogram = [0] * (len(CALL_HISTOGRAM_MS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.histogram[bisect_left(CALL_HISTOGRAM_MS, seconds * 1000)] += 1
+
+    def as_dict(self):
+        labels = ['<={}ms'.format(ms) for ms in CALL_HISTOGRAM_MS] + ['>{}ms'.format(CALL_HISTOGRAM_MS[-1])]
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'max_ms': self.max * 1000,
+            'slow': self.slow,
+            'histogram': {label: n for label, n in zip(labels, self.histogram) if n},
+        }
+
+
+call_stats = {}
+
+
+def _record_call(name, seconds, blocking=True):
+    stats = call_stats.get(name)
+    if stats is None:
+        stats = call_stats[name] = CallStats()
+    stats.add(seconds)
+    # Only synchronous calls hold up the event loop, coroutines just take a while.
+    if blocking and seconds > SLOW_CALL_THRESHOLD:
+        stats.slow += 1
+        logger.warning('%s took %.1fms', name, seconds * 1000)
+
+
+def log_error(fn=None, expected=()):
+    # Logs what `fn` raises with its traceback, the `expected` exceptions only
+    # as a warning. `@log_error` or `@log_error(expected=...)`.
+    if fn is None:
+        return lambda fn: log_error(fn, expected)
+
+    name = fn.__qualname__
+
+    def _log(e):
+        if isinstance(e, expected):
+            logger.warning('%s: %s', name, e or type(e).__name__)
+        else:
+            logger.exception(e)
+
+    if asyncio.iscoroutinefunction(fn):
+        @wraps(fn)
+        async def _wrap_logged_async(*args, **kwargs):
+            start = time.perf_counter() if INSTRUMENT_CALLS else None
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                _log(e)
+                raise e
+            finally:
+                if start is not None:
+                    _record_call(name, time.perf_counter() - start, blocking=False)
+
+        return _wrap_logged_async
 
     @wraps(fn)
     def _wrap_logged(*args, **kwargs):
+        start = time.perf_counter() if INSTRUMENT_CALLS else None
         try:
-            return fn(*args, *kwargs)
+            return fn(*args, **kwargs)
         except Exception as e:
-            logger.exception(e)
+            _log(e)
             raise e
+        finally:
+            if start is not None:
+                _record_call(name, time.perf_counter() - start)
     
     return _wrap_logged
 
 
-@log_error
-def execute(*args):
-    with Popen(args, stdout=PIPE) as process:
-        return process.stdout.read().decode('utf-8')
-    
+breaker = CircuitBreaker()
+
+
+Reading = namedtuple('Reading', ['value', 'stale'])
+
+
+class LastKnown:
+    # Keeps the last successfully read value per key and hands it out, flagged
+    # as stale, when a fresh read fails.
+
+    def __init__(self):
+        self._values = {}
+
+    async def read(self, key, reader, default=None):
+        try:
+            value = await reader()
+        except (CommandUnavailable, asyncio.TimeoutError, OSError, ValueError):
+            return Reading(self._values.get(key, default), True)
+        self._values[key] = value
+        return Reading(value, False)
+
+
+def execute(*args, timeout=COMMAND_TIMEOUT):
+    breaker.check(args[0])
+    return _execute(args, timeout)
+
+
+@log_error(expected=(OSError, TimeoutExpired))
+def _execute(args, timeout):
+    start = time.perf_counter()
+    try:
+        with Popen(args, stdout=PIPE) as process:
+            try:
+                stdout, _ = process.communicate(timeout=timeout)
+            except TimeoutExpired:
+                process.kill()
+                raise
+    except (OSError, TimeoutExpired):
+        breaker.failure(args[0])
+        raise
+    breaker.success(args[0])
+    profiler.record(' '.join(args), 'subprocess', start, time.perf_counter())
+    return stdout.decode('utf-8')
+
+
+async def execute_async(*args, timeout=COMMAND_TIMEOUT):
+    breaker.check(args[0])
+    return await _execute_async(args, timeout)
+
+
+@log_error(expected=(OSError, asyncio.TimeoutError))
+async def _execute_async(args, timeout):
+    start = time.perf_counter()
+    try:
+        process = await asyncio.create_subprocess_exec(*args, stdout=PIPE)
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise asyncio.TimeoutError('{} timed out after {}s'.format(' '.join(args), timeout))
+    except (OSError, asyncio.TimeoutError):
+        breaker.failure(args[0])
+        raise
+    breaker.success(args[0])
+    profiler.record(' '.join(args), 'subprocess', start, time.perf_counter())
+    return stdout.decode('utf-8')
 
-def delay(fn, secs):
-    Timer(secs, fn).start()
+
+class WorkerPool:
+    # The one bounded executor for blocking widget work. A task submitted under
+    # a key that still has a task pending gets that task's future instead of
+    # starting another one.
+
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mods')
+        self._pending = {}
+
+    def submit(self, key, fn, *args, **kwargs):
+        future = self._pending.get(key)
+        if future is not None and not future.done():
+            return future
+        future = self._executor.submit(fn, *args, **kwargs)
+        self._pending[key] = future
+        future.add_done_callback(lambda f: self._pending.pop(key, None) if self._pending.get(key) is f else None)
+        return future
+
+
+workers = WorkerPool()
+
+
+scheduler = TickScheduler()
+
+
+class TitleTruncator:
+    # parse_text callback for WindowTabs. Titles are truncated by their rendered
+    # width in pixels, each title is measured once per font and the result is
+    # kept in an LRU cache keyed by the raw title, so an update where a single
+    # title changed only measures that one.
+
+    def __init__(self, separator, selected, max_width, font='monospace', fontsize=10,
+                 ellipsis='...', cache_size=512):
+        self.separator = separator
+        self.selected = selected
+        self.max_width = max_width
+        self.font = font
+        self.fontsize = fontsize
+        self.ellipsis = ellipsis
+        self.truncate_title = lru_cache(maxsize=cache_size)(self._truncate_title)
+        self._layout = None
+        self._last = (None, None)
+
+    def set_font(self, font, fontsize):
+        # Measures with the font of the widget the titles are drawn by.
+        # Returns whether earlier results are void.
+        if (font, fontsize) == (self.font, self.fontsize):
+            return False
+        self.font = font
+        self.fontsize = fontsize
+        self._layout = None
+        self._last = (None, None)
+        self.truncate_title.cache_clear()
+        return True
+
+    def __call__(self, text):
+        if text == self._last[0]:
+            return self._last[1]
+        result = self.separator.join(
+            self.truncate_segment(segment) for segment in text.split(self.separator))
+        self._last = (text, result)
+        return result
+
+    def truncate_segment(self, segment):
+        start, end = self.selected
+        if segment.startswith(start) and segment.endswith(end):
+            return self.truncate_title(segment[len(start):len(segment) - len(end)]).join(self.selected)
+        return self.truncate_title(segment)
+
+    def text_width(self, text):
+        if self._layout is None:
+            import cairocffi
+            from libqtile import pangocffi
+
+            surface = cairocffi.ImageSurface(cairocffi.FORMAT_ARGB32, 1, 1)
+            self._layout = pangocffi.create_layout(cairocffi.Context(surface))
+            desc = pangocffi.FontDescription.from_string(self.font)
+            desc.set_absolute_size(pangocffi.units_from_double(float(self.fontsize)))
+            self._layout.set_font_description(desc)
+        self._layout.set_text(text)
+        return self._layout.get_pixel_size()[0]
+
+    def _truncate_title(self, title):
+        # Titles arrive markup escaped, measure and cut the text the user sees.
+        text = unescape(title)
+        if self.text_width(text) <= self.max_width:
+            return title
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.text_width(text[:middle] + self.ellipsis) <= self.max_width:
+                low = middle
+            else:
+                high = middle - 1
+        return escape(text[:low] + self.ellipsis)
+
+
+def benchmark_titles(windows=60, updates=500, churn=3, separator=' || ', max_width=250):
+    # Times parse_text on the joined tab text of `windows` windows over
+    # `updates` updates in which `churn` titles change every time, like
+    # terminals showing a clock, with and without the title cache. Returns
+    # milliseconds per update.
+    selected = ('<b>', '</b>')
+    titles = ['{} - window {} - {}'.format(app, n, 'x' * (n % 40))
+              for n, app in enumerate(['terminator', 'firefox', 'code', 'gitk', 'nautilus'] * windows)][:windows]
+
+    def run(truncator):
+        start = time.perf_counter()
+        for update in range(updates):
+            for n in range(churn):
+                titles[(update * churn + n) % windows] = 'user@host: ~ {:08d}'.format(update * churn + n)
+            current = update % windows
+            truncator(separator.join(
+                escape(title).join(selected) if n == current else escape(title)
+                for n, title in enumerate(titles)))
+        return (time.perf_counter() - start) / updates * 1000
+
+    return {
+        'cached': run(TitleTruncator(separator, selected, max_width)),
+        'uncached': run(TitleTruncator(separator, selected, max_width, cache_size=0)),
+    }
+
+
+def window_state(window):
+    if window.maximized:
+        return '[] '
+    if window.minimized:
+        return '_ '
+    if window.floating:
+        return 'V '
+    return ''
+
+
+class ModWindowTabs(WindowTabs):
+    # Keeps the markup segment of every window and only rebuilds the segments
+    # whose title, state or selection changed. When the joined text is what is
+    # already shown nothing is redrawn, and since the widget stretches, a text
+    # change only redraws this widget instead of the whole bar.
+
+    def __init__(self, **config):
+        super().__init__(**config)
+        self._segments = {}
+
+    def _configure(self, qtile, bar):
+        super()._configure(qtile, bar)
+        if isinstance(self.parse_text, TitleTruncator):
+            if self.parse_text.set_font(self.font, self.fontsize):
+                self._segments = {}
+
+    def _segment(self, name, state, selected):
+        segment = escape(state + name)
+        if selected:
+            segment = segment.join(self.selected)
+        if callable(self.parse_text):
+            try:
+                segment = self.parse_text(segment)
+            except Exception:
+                logger.exception('parse_text function failed:')
+        return segment
+
+    def update(self, *args):
+        group = self.bar.screen.group
+        segments = {}
+        for window in group.windows:
+            key = (window.name or '', window_state(window), window is group.current_window)
+            cached = self._segments.get(window.wid)
+            if cached is None or cached[0] != key:
+                cached = (key, self._segment(*key))
+            segments[window.wid] = cached
+        self._segments = segments
+
+        text = self.separator.join(segment for _, segment in segments.values())
+        if text == self.text:
+            return
+        self.text = text
+        self.draw()
+
+
+async def pactl_subscribe():
+    # pactl translates its event lines, PULSE_EVENT_RE needs the C locale.
+    process = await asyncio.create_subprocess_exec(
+        'pactl', 'subscribe', stdout=PIPE, stderr=DEVNULL,
+        env={**os.environ, 'LC_ALL': 'C'})
+    try:
+        async for line in process.stdout:
+            yield line.decode('utf-8')
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+
+def pulse_event_facets(line):
+    # None for lines that are not events.
+    match = PULSE_EVENT_RE.match(line.strip())
+    if not match:
+        return None
+    return PULSE_FACILITY_FACETS.get(match.group('facility'), set())
 
 
 class Volume(base._TextBox):
@@ -107,27 +579,147 @@ class Volume(base._TextBox):
         self.frame_background_color = config.get('frame_background_color', palette.background)
         self.show_frame = config.get('show_frame', True)
         self.audio_mixer_command = config.get('audio_mixer_command', 'pavucontrol')
+        self.audio_mixer_match = config.get(
+            'audio_mixer_match', Match(wm_class=self.audio_mixer_command.split()[0]))
         self.mic_muted = config.get('mic_muted', MIC_MUTED)
+        # With subscribe=True the widget follows a single long-lived PulseAudio
+        # event stream and only re-reads the facets an event touches.
+        self.subscribe = config.get('subscribe', False)
+        self.event_source = config.get('event_source', pactl_subscribe)
+        self.step = config.get('step', 5)
+        self.volume_steps = StepCoalescer(
+            self._apply_volume_delta,
+            on_pending=lambda _: self._render_state(),
+            window=config.get('step_window', 0.15),
+        )
+
+        self._state = None
+        self._readings = LastKnown()
+        self._dirty_facets = set()
+        self._refresh_task = None
+        self._subscription = None
+        self._streaming = False
+        self._audio_mixer = None
+
+    def _configure(self, qtile, bar):
+        super(Volume, self)._configure(qtile, bar)
+        # Both paths only schedule the first fetch, the bar is drawn before
+        # pamixer answers.
+        if not self.subscribe:
+            self._refresh_facets(set(VOLUME_FACETS))
+        elif self._subscription is None:
+            self._subscription = asyncio.ensure_future(self._follow_events())
+
+    def finalize(self):
+        if self._subscription is not None:
+            self._subscription.cancel()
+            self._subscription = None
+        super(Volume, self).finalize()
+
+    async def _follow_events(self):
+        # pactl exits when the sound server restarts, reconnect with a growing
+        # pause. Until a stream delivers events it can parse, the commands
+        # refresh the widget themselves. Every burst of events costs one
+        # pamixer fork per facet it touches, two for a sink and three for a
+        # server event; a native client like pulsectl would read them over
+        # the stream's own connection but is one more dependency.
+        retry = 1
+        while True:
+            self._refresh_facets(set(VOLUME_FACETS))
+            try:
+                async for line in self.event_source():
+                    facets = pulse_event_facets(line)
+                    if facets is None:
+                        continue
+                    self._streaming = True
+                    retry = 1
+                    if facets:
+                        self._refresh_facets(facets)
+            except FileNotFoundError as e:
+                logger.warning('volume event stream unavailable: %s', e)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                self._streaming = False
+            await asyncio.sleep(retry)
+            retry = min(retry * 2, 300)
+
+    def _refresh_facets(self, facets):
+        self._dirty_facets |= facets
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+
+    @log_error
+    async def _refresh(self):
+        # Let a burst of events accumulate, then read the state once per burst.
+        await asyncio.sleep(0)
+        while self._dirty_facets:
+            facets, self._dirty_facets = self._dirty_facets, set()
+            self._set_state(await self._read_state(facets))
+
+    async def _read_state(self, facets):
+        state = self._state or VolumeState(0, False, False)
+        readers = {
+            'volume': self._query_volume,
+            'muted': self._query_muted,
+            'mic_muted': self._query_mic_muted,
+        }
+        fields = [field for field in VOLUME_FACETS if field in facets]
+        readings = await asyncio.gather(*[readers[field]() for field in fields])
+        return state._replace(
+            stale=any(reading.stale for reading in readings),
+            **{field: reading.value for field, reading in zip(fields, readings)},
+        )
+
+    def _set_state(self, state):
+        if state == self._state:
+            return
+        self._state = state
+        self._render_state()
+
+    def _render_state(self):
+        if self._state is None:
+            return
+        # Show the target of not yet applied volume steps right away.
+        volume = max(0, min(100, self._state.volume + self.volume_steps.pending))
+        self._render(self._state._replace(volume=volume))
 
-        self._show_volume()
-    
     def _show_volume(self):
-        vol = int(execute('pamixer', '--get-volume'))
+        self._refresh_facets(set(VOLUME_FACETS))
+
+    def palette_changed(self):
+        if self._state is not None:
+            self.text = self._format(self._state)
+
+    def _render(self, state):
+        txt_format = self._format(state)
+
+        if txt_format == self.text:
+            return
+
+        self.text = txt_format
+
+        self.draw()
+
+    def _format(self, state):
+        vol = state.volume
 
         speaker_level = vol//(100//len(self.speaker_leves))
         if speaker_level == len(self.speaker_leves):
             speaker_level = len(self.speaker_leves) - 1
         
-        if not vol or self._is_muted():
+        if not vol or state.muted:
             speaker_level = '<span color="{}">{}</span>'.format(palette.danger, self.speaker_muted)
         else:
             speaker_level = self.speaker_leves[speaker_level]
 
-        mic_muted = self._is_mic_muted()
-
         txt_format = '{} {:>3}'.format(speaker_level, vol)
 
-        if mic_muted:
+        if state.stale:
+            # pamixer did not answer, this is the last known value
+            txt_format = '<span color="{}">{}</span>'.format(palette.warning, txt_format)
+
+        if state.mic_muted:
             txt_format = '{} {}'.format(
                 '<span color="{}">{}</span>'.format(palette.danger, self.mic_muted),
                 txt_format,
@@ -136,101 +728,732 @@ class Volume(base._TextBox):
         if self.show_frame:
             txt_format = '{}{}{}'.format(self.frames[0], txt_format, self.frames[1])
 
-        self.text = txt_format
+        return txt_format
 
-        self.draw()
+    @log_error
+    async def _pamixer(self, *args):
+        try:
+            await execute_async('pamixer', *args)
+        except (CommandUnavailable, asyncio.TimeoutError) as e:
+            logger.warning('pamixer %s failed: %s', ' '.join(args), e or 'timed out')
+        # With a live event stream the resulting PulseAudio event triggers the
+        # refresh.
+        if not self._streaming:
+            self._show_volume()
+
+    def _find_audio_mixer(self):
+        for window in self.qtile.windows_map.values():
+            if getattr(window, 'group', None) and self.audio_mixer_match.compare(window):
+                return window
+        return None
 
     @log_error
     def show_audio_mixer(self, *args, **kwargs):
-        from threading import Thread
-        from subprocess import run
+        window = self._find_audio_mixer()
+        if window is not None:
+            window.group.cmd_toscreen()
+            window.group.focus(window)
+            window.cmd_bring_to_front()
+            return
+        # The task lasts as long as the mixer runs, clicks while it is starting
+        # up do not launch another one.
+        if self._audio_mixer is None or self._audio_mixer.done():
+            self._audio_mixer = asyncio.ensure_future(self._run_audio_mixer())
+
+    @log_error
+    async def _run_audio_mixer(self):
+        process = await asyncio.create_subprocess_shell(
+            self.audio_mixer_command, stdout=DEVNULL, stderr=DEVNULL)
+        await process.wait()
 
-        thr = Thread(target=lambda: run(self.audio_mixer_command, shell=True))
-        thr.start()
+    def _apply_volume_delta(self, delta):
+        if self._state is not None:
+            volume = max(0, min(100, self._state.volume + delta))
+            self._state = self._state._replace(volume=volume)
+        if delta > 0:
+            asyncio.ensure_future(self._pamixer('-i', str(delta)))
+        else:
+            asyncio.ensure_future(self._pamixer('-d', str(-delta)))
 
     @log_error
     def cmd_volume_up(self):
-        execute('pamixer', '-i', '5')
-        self._show_volume()
+        self.volume_steps.push(self.step)
     
     @log_error
     def cmd_volume_down(self):
-        execute('pamixer', '-d', '5')
-        self._show_volume()
+        self.volume_steps.push(-self.step)
     
 
-    def _is_muted(self):
-        return execute('pamixer', '--get-mute').strip().lower() == 'true'
-    
-    def _is_mic_muted(self):
-        return execute('pamixer', '--default-source', '--get-mute').strip().lower() == 'true'
+    async def _query_volume(self):
+        async def read():
+            return int(await execute_async('pamixer', '--get-volume'))
+        return await self._readings.read('volume', read, 0)
+
+    async def _query_muted(self):
+        async def read():
+            return (await execute_async('pamixer', '--get-mute')).strip().lower() == 'true'
+        return await self._readings.read('muted', read, False)
+
+    async def _query_mic_muted(self):
+        async def read():
+            return (await execute_async('pamixer', '--default-source', '--get-mute')).strip().lower() == 'true'
+        return await self._readings.read('mic_muted', read, False)
 
     @log_error
     def cmd_mute(self):
-        if self._is_muted():
-            pass
-        execute('pamixer', '--mute')
-        self._show_volume()
+        asyncio.ensure_future(self._pamixer('--mute'))
 
     @log_error
     def cmd_unmute(self):
-        if not self._is_muted():
-            pass
-        execute('pamixer', '--unmute')
-        self._show_volume()
+        asyncio.ensure_future(self._pamixer('--unmute'))
     
     @log_error
     def cmd_mic_mute(self):
-        if self._is_mic_muted():
-            pass
-        execute('pamixer', '--default-source', '--mute')
-        self._show_volume()
+        asyncio.ensure_future(self._pamixer('--default-source', '--mute'))
 
     @log_error
     def cmd_mic_unmute(self):
-        if not self._is_mic_muted():
-            pass
-        execute('pamixer', '--default-source', '--unmute')
-        self._show_volume()
+        asyncio.ensure_future(self._pamixer('--default-source', '--unmute'))
 
     @log_error
     def cmd_toggle_muted(self):
-        if self._is_muted():
-            self.cmd_unmute()
-        else:
-            self.cmd_mute()
-    
+        # pamixer toggles in one call, so quick presses cannot both read the
+        # same state and send the same change.
+        asyncio.ensure_future(self._pamixer('--toggle-mute'))
+
     @log_error
     def cmd_toggle_mic_muted(self):
-        if self._is_mic_muted():
-            self.cmd_mic_unmute()
-        else:
-            self.cmd_mic_mute()
-    
+        asyncio.ensure_future(self._pamixer('--default-source', '--toggle-mute'))
+
+
+class XkbGroups:
+    # Switches between layouts loaded as XKB groups ("us,mk") with a group lock
+    # instead of reloading the keymap, and reports group changes made by anyone
+    # through XKB StateNotify events on a connection of its own.
+
+    def __init__(self, on_group_change):
+        import xcffib
+        import xcffib.xkb
+
+        self.on_group_change = on_group_change
+        self.device = xcffib.xkb.ID.UseCoreKbd
+        self.group_state = xcffib.xkb.StatePart.GroupState
+        self.conn = xcffib.connect()
+        self.xkb = self.conn(xcffib.xkb.key)
+        self.xkb.UseExtension(1, 0).reply()
+        state_notify = xcffib.xkb.EventType.StateNotify
+        self.xkb.SelectEvents(self.device, state_notify, 0, state_notify, 0, 0, {})
+        self.conn.flush()
+        self._fd = self.conn.get_file_descriptor()
+        asyncio.get_event_loop().add_reader(self._fd, self._on_readable)
+
+    def group(self):
+        return self.xkb.GetState(self.device).reply().group
+
+    def lock_group(self, index):
+        self.xkb.LatchLockState(self.device, 0, 0, True, index, 0, False, 0)
+        self.conn.flush()
+
+    @log_error
+    def _on_readable(self):
+        # StateNotify also fires for every modifier press, only events that
+        # changed the effective group count and they carry the group already.
+        group = None
+        while True:
+            event = self.conn.poll_for_event()
+            if event is None:
+                break
+            if getattr(event, 'changed', 0) & self.group_state:
+                group = event.group
+        if group is not None:
+            self.on_group_change(group)
+
+    def close(self):
+        asyncio.get_event_loop().remove_reader(self._fd)
+        self.conn.disconnect()
+
+
+def window_class(window):
+    wm_class = window.get_wm_class() if hasattr(window, 'get_wm_class') else None
+    return wm_class[-1] if wm_class else None
+
 
 class ModKeyboardLayout(KeyboardLayout):
 
     def __init__(self, **config):
+        # Every change goes through set_keyboard or an XKB event, which redraw
+        # right away, so there is nothing to poll for.
+        config.setdefault('update_interval', None)
         super().__init__(**config)
         self.focused_window = None
+        self.layout_store = KeyboardLayoutStore(config.get(
+            'layout_store_path',
+            os.path.expanduser('~/.cache/qtile/keyboard_layouts.tsv'),
+        ))
+        # The active layout, authoritative after our own switches and updated
+        # from XKB events, so focus changes never have to query setxkbmap.
+        self.current_keyboard = None
+        self._xkb = None
+        self._loading_groups = None
+
+    def _configure(self, qtile, bar):
+        # qtile configures the widget again whenever the screens are
+        # reconfigured, the layout and the XKB connection carry over.
+        first_configure = not self.configured
+        super()._configure(qtile, bar)
+        if not first_configure or self._xkb is not None:
+            return
+        if self.configured_keyboards:
+            self.current_keyboard = self.configured_keyboards[0]
+        if qtile.core.name == 'x11' and self._can_use_groups():
+            # Loading the layouts waits for setxkbmap, keep it out of bar setup.
+            self._loading_groups = asyncio.ensure_future(self._setup_groups())
+
+    async def _setup_groups(self):
+        try:
+            await self._load_groups()
+        except Exception as e:
+            logger.warning('XKB group switching unavailable, using setxkbmap: %s', e)
+            self._xkb = None
+            if self.current_keyboard:
+                self.backend.set_keyboard(self.current_keyboard, self.option)
+
+    def _can_use_groups(self):
+        # XKB supports up to four groups and they can only hold plain layouts.
+        keyboards = self.configured_keyboards
+        return 1 < len(keyboards) <= 4 and not any(' ' in keyboard for keyboard in keyboards)
+
+    async def _load_groups(self):
+        command = ['setxkbmap', '-layout', ','.join(self.configured_keyboards)]
+        if self.option:
+            command.extend(['-option', self.option])
+        await execute_async(*command)
+        self._xkb = XkbGroups(self._on_group_change)
+        # Windows focused meanwhile may have picked another layout.
+        keyboards = self.configured_keyboards
+        keyboard = self.current_keyboard
+        self._xkb.lock_group(keyboards.index(keyboard) if keyboard in keyboards else 0)
+
+    def _on_group_change(self, group):
+        if group < len(self.configured_keyboards):
+            keyboard = self.configured_keyboards[group]
+            if keyboard != self.current_keyboard:
+                self.current_keyboard = keyboard
+                self.tick()
+
+    def finalize(self):
+        if self._loading_groups is not None:
+            self._loading_groups.cancel()
+            self._loading_groups = None
+        if self._xkb is not None:
+            self._xkb.close()
+            self._xkb = None
+        super().finalize()
+
+    def poll(self):
+        keyboard = self.current_keyboard or self.backend.get_keyboard()
+        if keyboard in self.display_map:
+            return self.display_map[keyboard]
+        return keyboard.upper()
+
+    def set_keyboard(self, keyboard):
+        if keyboard == self.current_keyboard:
+            return
+        if self._loading_groups is not None and not self._loading_groups.done():
+            # _load_groups switches to current_keyboard when it is done.
+            pass
+        elif self._xkb is not None and keyboard in self.configured_keyboards:
+            self._xkb.lock_group(self.configured_keyboards.index(keyboard))
+        else:
+            self.backend.set_keyboard(keyboard, self.option)
+        self.current_keyboard = keyboard
+        self.tick()
     
     def cmd_window_focus(self, window):
         self.focused_window = window
 
-        if hasattr(window, 'keyboard') and window.keyboard:
-            if window.keyboard == self.backend.get_keyboard():
-                return
-            self.backend.set_keyboard(window.keyboard, self.option)
-            self.tick()
+        keyboard = self.layout_store.lookup(window.wid, window_class(window))
+        if keyboard:
+            self.set_keyboard(keyboard)
         elif self.configured_keyboards:
-            if self.configured_keyboards[0] == self.backend.get_keyboard():
-                return
-            self.backend.set_keyboard(self.configured_keyboards[0], self.option)
-            self.tick()
+            self.set_keyboard(self.configured_keyboards[0])
+
+    def cmd_window_killed(self, window):
+        if window is self.focused_window:
+            self.focused_window = None
+        self.layout_store.forget_window(window.wid)
+
+    def cmd_forget_closed_windows(self):
+        self.layout_store.retain_windows(self.qtile.windows_map)
 
     
     def next_keyboard(self):
-        super().next_keyboard()
+        if not self.configured_keyboards:
+            return
+        if self.current_keyboard in self.configured_keyboards:
+            index = self.configured_keyboards.index(self.current_keyboard) + 1
+        else:
+            index = 0
+        self.set_keyboard(self.configured_keyboards[index % len(self.configured_keyboards)])
         if self.focused_window:
-            self.focused_window.keyboard = self.backend.get_keyboard()
+            self.layout_store.remember(
+                self.focused_window.wid,
+                window_class(self.focused_window),
+                self.current_keyboard,
+            )
+
+
+class Inotify:
+    # inotify through ctypes, read on the event loop. Sysfs attributes report
+    # writes made through the filesystem and the kernel's sysfs_notify calls.
+
+    def __init__(self, on_change):
+        self.on_change = on_change
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            self._raise_errno()
+        self._paths = {}
+        asyncio.get_event_loop().add_reader(self._fd, self._on_readable)
+
+    def _raise_errno(self):
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+    def watch(self, path, mask=IN_MODIFY | IN_CLOSE_WRITE):
+        wd = self.libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            self._raise_errno()
+        self._paths[wd] = path
+
+    @log_error
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        paths = set()
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size + length
+            if wd in self._paths:
+                paths.add(self._paths[wd])
+        if paths:
+            self.on_change(paths)
+
+    def close(self):
+        asyncio.get_event_loop().remove_reader(self._fd)
+        os.close(self._fd)
+
+
+class PowerSupplyEvents:
+    # The kernel announces AC plug/unplug and battery status changes as
+    # power_supply uevents on a netlink socket, not through inotify.
+
+    def __init__(self, on_change):
+        self.on_change = on_change
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        self.sock.bind((0, 1))
+        self.sock.setblocking(False)
+        asyncio.get_event_loop().add_reader(self.sock.fileno(), self._on_readable)
+
+    @log_error
+    def _on_readable(self):
+        changed = False
+        while True:
+            try:
+                data = self.sock.recv(16384)
+            except BlockingIOError:
+                break
+            changed = changed or b'SUBSYSTEM=power_supply' in data.split(b'\0')
+        if changed:
+            self.on_change()
+
+    def close(self):
+        asyncio.get_event_loop().remove_reader(self.sock.fileno())
+        self.sock.close()
+
+
+class ModBacklight(base._TextBox):
+    # Reads and writes /sys/class/backlight/<backlight_name> directly instead
+    # of polling and forking. Brightness changes are picked up with inotify,
+    # or by polling every update_interval seconds where that fails.
+    # change_command is only used when the brightness file is not writable.
+
+    def __init__(self, **config):
+        config.setdefault('name', 'backlight')
+        super().__init__('', bar.CALCULATED, **config)
+        self.sysfs_root = config.get('sysfs_root', SYSFS_ROOT)
+        self.backlight_name = config.get('backlight_name', 'acpi_video0')
+        self.format = config.get('format', '{percent:2.0%}')
+        self.step = config.get('step', 10)
+        self.min_brightness = config.get('min_brightness', 5)
+        self.update_interval = config.get('update_interval', 60)
+        self.change_command = config.get('change_command')
+        self.backlight_steps = StepCoalescer(
+            self._apply_backlight_delta,
+            on_pending=self._show_pending_backlight,
+            window=config.get('step_window', 0.15),
+        )
+        self._level = BacklightLevel(self.min_brightness)
+        self._max_brightness = None
+        self._inotify = None
+        self._poll_handle = None
+
+    def _path(self, name):
+        return os.path.join(self.sysfs_root, 'class', 'backlight', self.backlight_name, name)
+
+    def _configure(self, qtile, bar):
+        super()._configure(qtile, bar)
+        self._max_brightness = read_sysfs_int(self._path('max_brightness'))
+        self._read_brightness()
+        if self._inotify is not None or self._poll_handle is not None:
+            return
+        try:
+            self._inotify = Inotify(lambda _: self._read_brightness())
+            self._inotify.watch(self._path('brightness'))
+            # The kernel announces changes it makes itself, e.g. hotkeys handled
+            # by ACPI, with sysfs_notify on actual_brightness, which inotify
+            # reports as a modification.
+            if os.path.exists(self._path('actual_brightness')):
+                self._inotify.watch(self._path('actual_brightness'))
+        except OSError as e:
+            logger.info('backlight: no inotify ({}), polling every {}s'.format(e, self.update_interval))
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+            self._poll()
+
+    def finalize(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        if self._poll_handle is not None:
+            self._poll_handle.cancel()
+            self._poll_handle = None
+        super().finalize()
+
+    def _poll(self):
+        self._read_brightness()
+        self._poll_handle = scheduler.call_later(self.update_interval, self._poll)
+
+    @log_error
+    def _read_brightness(self):
+        brightness = read_sysfs_int(self._path('brightness'))
+        if brightness is None or not self._max_brightness:
+            self._set_percent(None)
+        else:
+            self._set_percent(brightness / self._max_brightness)
+
+    def _set_percent(self, percent):
+        if percent == self._level.percent and self.text:
+            return
+        self._level.read(percent)
+        if self.backlight_steps.pending:
+            return
+        scheduler.update(self, 'Error' if percent is None else self.format.format(percent=percent))
+
+    def _show_pending_backlight(self, delta):
+        scheduler.update_now(self, self.format.format(percent=self._level.target(delta) / 100))
+
+    @log_error
+    def _apply_backlight_delta(self, delta):
+        self._set_backlight(self._level.end_burst(delta))
+
+    @log_error
+    def _set_backlight(self, percent):
+        value = round(percent / 100 * self._max_brightness)
+        try:
+            with open(self._path('brightness'), 'w') as f:
+                f.write(str(value))
+        except PermissionError:
+            if not self.change_command:
+                raise
+            self._level.applied = percent / 100
+            asyncio.ensure_future(execute_async(*self.change_command.format(percent).split()))
+            return
+        self._set_percent(value / self._max_brightness)
+
+    @log_error
+    def cmd_change_backlight(self, direction, step=None):
+        if self._level.percent is None:
+            return
+        self._level.start_burst()
+        step = step or self.step
+        self.backlight_steps.push(step if direction is ChangeDirection.UP else -step)
+
+
+class ModBattery(base._TextBox):
+    # Reads /sys/class/power_supply directly on the worker pool. Status changes
+    # arrive as uevents where netlink is available, the rest is polled: every
+    # update_interval seconds on battery, every slow_update_interval on AC
+    # once the status is steady and every fast_update_interval for fast_reads
+    # reads after the status or the AC adapter changed.
+
+    def __init__(self, **config):
+        config.setdefault('name', 'battery')
+        super().__init__('', bar.CALCULATED, **config)
+        self.sysfs_root = config.get('sysfs_root', SYSFS_ROOT)
+        self.battery_name = config.get('battery_name')
+        self.format = config.get('format', '{char} {percent:2.0%} {hour:d}:{min:02d}')
+        self.charge_char = config.get('charge_char', '^')
+        self.discharge_char = config.get('discharge_char', 'V')
+        self.full_char = config.get('full_char', '=')
+        self.not_charging_char = config.get('not_charging_char', '*')
+        self.empty_char = config.get('empty_char', 'x')
+        self.unknown_char = config.get('unknown_char', '?')
+        self.low_percentage = config.get('low_percentage', 0.1)
+        self.update_interval = config.get('update_interval', 60)
+        self.slow_update_interval = config.get('slow_update_interval', 300)
+        self.fast_update_interval = config.get('fast_update_interval', 2)
+        self.fast_reads = config.get('fast_reads', 5)
+        self.uevents = config.get('uevents', True)
+        self._intervals = BatteryIntervals(
+            self.update_interval, self.slow_update_interval,
+            self.fast_update_interval, self.fast_reads)
+        self._state = None
+        self._poll_handle = None
+        self._events = None
+
+    def _configure(self, qtile, bar):
+        super()._configure(qtile, bar)
+        if self.uevents and self._events is None:
+            try:
+                self._events = PowerSupplyEvents(self._on_uevent)
+            except OSError as e:
+                logger.info('battery: no uevents ({}), polling only'.format(e))
+        if self._poll_handle is None:
+            self._schedule(0)
+
+    def finalize(self):
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+        if self._poll_handle is not None:
+            self._poll_handle.cancel()
+            self._poll_handle = None
+        super().finalize()
+
+    def _schedule(self, interval):
+        if self._poll_handle is not None:
+            self._poll_handle.cancel()
+        self._poll_handle = scheduler.call_later(interval, self._start_poll)
+
+    def _start_poll(self):
+        asyncio.ensure_future(self._poll())
+
+    def _on_uevent(self):
+        self._intervals.changed()
+        self._schedule(0)
+
+    @log_error
+    async def _poll(self):
+        future = workers.submit('battery', read_battery, self.sysfs_root, self.battery_name)
+        state = await asyncio.wrap_future(future)
+        self._schedule(self._intervals.next(self._state, state))
+        self._set_state(state)
+
+    def _char(self, state):
+        if state.status == 'Charging':
+            return self.charge_char
+        if state.status == 'Discharging':
+            return self.empty_char if state.percent <= self.low_percentage else self.discharge_char
+        if state.status == 'Full':
+            return self.full_char
+        if state.status == 'Not charging':
+            return self.not_charging_char
+        return self.unknown_char
+
+    def _set_state(self, state):
+        if state == self._state and self.text:
+            return
+        self._state = state
+        if state is None:
+            scheduler.update(self, 'Error')
+            return
+        minutes = round((state.hours or 0) * 60)
+        scheduler.update(self, self.format.format(
+            char=self._char(state),
+            percent=state.percent,
+            hour=minutes // 60,
+            min=minutes % 60,
+            watt=state.watt or 0,
+        ))
+
+
+def _resolve_theme(value):
+    if isinstance(value, ThemeColor):
+        return value.resolve(palette)
+    if isinstance(value, (list, tuple)) and any(isinstance(v, ThemeColor) for v in value):
+        return type(value)(v.resolve(palette) if isinstance(v, ThemeColor) else v for v in value)
+    return value
+
+
+def _retheme(obj):
+    # qtile's Configurable reads options from _user_config on first access,
+    # options nobody read yet are only there.
+    user_config = vars(obj).get('_user_config')
+    if isinstance(user_config, dict):
+        for key, value in list(user_config.items()):
+            user_config[key] = _resolve_theme(value)
+    for attr, value in list(vars(obj).items()):
+        resolved = _resolve_theme(value)
+        if resolved is not value:
+            setattr(obj, attr, resolved)
+
+
+@log_error
+def apply_palette(qtile, **colors):
+    # Pushes new palette colors into the running bars, widgets and layouts and
+    # redraws each bar once, e.g. lazy.function(apply_palette, primary='#ff0000').
+    set_palette_colors(palette, colors)
+
+    for widget in qtile.widgets_map.values():
+        _retheme(widget)
+        layout = getattr(widget, 'layout', None)
+        if layout is not None and hasattr(layout, 'colour'):
+            layout.colour = widget.foreground
+        if hasattr(widget, 'palette_changed'):
+            widget.palette_changed()
+
+    for group in qtile.groups:
+        for layout in group.layouts:
+            _retheme(layout)
+        if group.screen:
+            group.layout_all()
+
+    for screen in qtile.screens:
+        for position in (screen.top, screen.bottom, screen.left, screen.right):
+            if isinstance(position, bar.Bar):
+                _retheme(position)
+                position.draw()
+
+
+def reload_palette(qtile):
+    apply_palette(qtile, **read_palette_file())
+
+
+class DrawStats:
+
+    def __init__(self):
+        self.count = 0
+        self.suppressed = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        return {
+            'draws': self.count,
+            'suppressed': self.suppressed,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'max_ms': self.max * 1000,
+        }
+
+
+# Keyed by "<bar name>" and "<bar name>/<widget name>"
+draw_stats = {}
+
+
+def _draw_key(widget):
+    # What a text widget shows, draws with an unchanged key are redundant.
+    if not hasattr(widget, 'text'):
+        return None
+    return (widget.text, widget.foreground, widget.background,
+            widget.offsetx, widget.offsety, widget.length)
+
+
+def _instrument_widget_draw(widget, stats, bar_state, suppress_redundant):
+    original = widget.draw
+    last_key = None
+
+    def draw():
+        nonlocal last_key
+        key = _draw_key(widget) if suppress_redundant else None
+        if key is not None and key == last_key and not bar_state.drawing:
+            stats.suppressed += 1
+            return
+        start = time.perf_counter()
+        original()
+        stats.add(time.perf_counter() - start)
+        last_key = key
+
+    widget.draw = draw
+
+
+def instrument_bar(bar, name, suppress_redundant=True):
+    # Counts and times the draws of the bar and of each of its widgets. A text
+    # widget asking to draw the exact same text at the same place is skipped;
+    # draws of the whole bar always go through since the bar may have been
+    # exposed or resized.
+    bar_stats = draw_stats.setdefault(name, DrawStats())
+    bar_state = SimpleNamespace(drawing=False)
+    original = bar._actual_draw
+
+    def _actual_draw():
+        start = time.perf_counter()
+        bar_state.drawing = True
+        try:
+            original()
+        finally:
+            bar_state.drawing = False
+            bar_stats.add(time.perf_counter() - start)
+
+    bar._actual_draw = _actual_draw
+
+    for widget in bar.widgets:
+        stats = draw_stats.setdefault('{}/{}'.format(name, widget.name), DrawStats())
+        _instrument_widget_draw(widget, stats, bar_state, suppress_redundant)
+
+
+class ModStats(base._Widget):
+    # Zero width widget that exposes the collected stats as qtile commands,
+    # e.g. `qtile cmd-obj -o widget mod_stats -f call_stats`.
+
+    def __init__(self, **config):
+        config['name'] = 'mod_stats'
+        super(ModStats, self).__init__(0, **config)
+
+    def draw(self):
+        pass
+
+    def cmd_call_stats(self, reset=False):
+        stats = {name: stats.as_dict() for name, stats in call_stats.items()}
+        if reset:
+            call_stats.clear()
+        return stats
+
+    def cmd_draw_stats(self, path=None, reset=False):
+        stats = {name: stats.as_dict() for name, stats in draw_stats.items()}
+        if path:
+            with open(os.path.expanduser(path), 'w') as f:
+                json.dump(stats, f, indent=2, sort_keys=True)
+        if reset:
+            for stats in draw_stats.values():
+                stats.__init__()
+        return stats
+
+    def cmd_tick_stats(self, reset=False):
+        stats = scheduler.stats()
+        if reset:
+            scheduler.reset_stats()
+        return stats
+
+    def cmd_instrument_calls(self, enabled=True):
+        global INSTRUMENT_CALLS
+        INSTRUMENT_CALLS = bool(enabled)
+        return INSTRUMENT_CALLS
+
+
+if __name__ == '__main__':
+    import sys
 
+    args = [int(arg) for arg in sys.argv[1:4]]
+    for label, ms in benchmark_titles(*args).items():
+        print('{:9} {:8.3f} ms per update'.format(label, ms))
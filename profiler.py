@@ -0,0 +1,120 @@
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+
+# Set QTILE_PROFILE=1 in qtile's environment to profile config loading.
+ENABLED = bool(os.environ.get('QTILE_PROFILE'))
+TRACE_PATH = os.path.expanduser('~/.cache/qtile/startup-trace.json')
+
+
+class Profiler:
+    # Records wall time spans of config loading. write() produces a Chrome
+    # trace (chrome://tracing, speedscope, perfetto all render it as a flame
+    # graph) and a summary table next to it. When disabled every method is a
+    # no-op.
+
+    def __init__(self, enabled=ENABLED, trace_path=TRACE_PATH):
+        self.enabled = enabled
+        self.trace_path = trace_path
+        self.origin = time.perf_counter()
+        self.spans = []
+        self._last_mark = self.origin
+
+    @contextmanager
+    def phase(self, name, category='config'):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, time.perf_counter())
+
+    def mark(self, name, category='config'):
+        # Records the time since the previous mark as phase `name`, so the
+        # sections of a module can be timed without indenting them.
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.record(name, category, self._last_mark, now)
+        self._last_mark = now
+
+    def record(self, name, category, start, end):
+        if self.enabled:
+            self.spans.append((name, category, start, end))
+
+    def instrument_constructors(self, *classes):
+        # Times each construction of the given widget classes, including their
+        # base class constructors.
+        if not self.enabled:
+            return
+        for cls in classes:
+            original = cls.__init__
+
+            def __init__(obj, *args, __cls=cls, __original=original, **kwargs):
+                timed = type(obj) is __cls
+                with self.phase('widget ' + __cls.__name__, 'widget') if timed else nullcontext():
+                    __original(obj, *args, **kwargs)
+
+            cls.__init__ = __init__
+
+    def instrument_first_draw(self, bar):
+        # Records the first draw of the bar and writes the trace after it.
+        if not self.enabled:
+            return
+        original = bar._actual_draw
+        drawn = False
+
+        def _actual_draw():
+            nonlocal drawn
+            if drawn:
+                return original()
+            drawn = True
+            with self.phase('first bar draw', 'draw'):
+                original()
+            self.write()
+
+        bar._actual_draw = _actual_draw
+
+    def trace_events(self):
+        # Subprocesses run concurrently with config code, so they get a thread
+        # lane of their own in the trace.
+        lanes = {'subprocess': 2}
+        return [
+            {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': (start - self.origin) * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': os.getpid(),
+                'tid': lanes.get(category, 1),
+            }
+            for name, category, start, end in self.spans
+        ]
+
+    def summary(self):
+        totals = defaultdict(lambda: [0, 0.0])
+        for name, category, start, end in self.spans:
+            totals[(category, name)][0] += 1
+            totals[(category, name)][1] += end - start
+        lines = ['{:<10} {:<48} {:>5} {:>10}'.format('category', 'phase', 'count', 'ms')]
+        for (category, name), (count, seconds) in sorted(totals.items(), key=lambda t: -t[1][1]):
+            lines.append('{:<10} {:<48} {:>5} {:>10.2f}'.format(category, name[:48], count, seconds * 1000))
+        return '\n'.join(lines)
+
+    def write(self):
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(self.trace_path), exist_ok=True)
+        with open(self.trace_path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events()}, f)
+        with open(os.path.splitext(self.trace_path)[0] + '.txt', 'w') as f:
+            f.write(self.summary() + '\n')
+
+
+profiler = Profiler()
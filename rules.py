@@ -0,0 +1,178 @@
+import time
+from collections import defaultdict, namedtuple
+from functools import lru_cache
+
+
+# Match properties that can be answered from a window's properties alone, in
+# the order tried when picking the one a rule is indexed under.
+INDEXED_FIELDS = ('wm_class', 'wm_instance_class', 'role', 'wm_type', 'title')
+
+WindowProps = namedtuple('WindowProps', 'wm_class title role wm_type')
+
+Placement = namedtuple('Placement', 'float group layout')
+
+NO_PLACEMENT = Placement(None, None, None)
+
+
+def window_props(window):
+    return WindowProps(
+        tuple(window.get_wm_class() or ()),
+        window.name,
+        window.get_wm_role(),
+        window.get_wm_type(),
+    )
+
+
+def _prop(props, field):
+    if field == 'wm_instance_class':
+        return props.wm_class[0] if props.wm_class else None
+    if field == 'wm_class':
+        return props.wm_class or None
+    return getattr(props, field)
+
+
+def _field_matches(field, value, prop):
+    # Same semantics as Match.compare: a plain wm_class matches either part of
+    # WM_CLASS, patterns are anchored at the start with re.match.
+    if field == 'wm_class':
+        if isinstance(value, str):
+            return value in prop
+        return any(value.match(part) for part in prop)
+    if isinstance(value, str):
+        return value == prop
+    return value.match(prop) is not None
+
+
+class WindowRule:
+    # A qtile Match plus what to do with the windows it matches. None leaves
+    # the decision to a later rule or to qtile.
+
+    def __init__(self, match, float=None, group=None, layout=None):
+        self.match = match
+        self.float = float
+        self.group = group
+        self.layout = layout
+        fields = dict(getattr(match, '_rules', None) or {})
+        # Rules on func, net_wm_pid or wid need the window itself.
+        self.fields = fields if fields and set(fields) <= set(INDEXED_FIELDS) else None
+
+    def matches_props(self, props):
+        for field, value in self.fields.items():
+            prop = _prop(props, field)
+            if prop is None or not _field_matches(field, value, prop):
+                return False
+        return True
+
+    def index_key(self):
+        for field in INDEXED_FIELDS:
+            value = self.fields.get(field)
+            if isinstance(value, str):
+                return field, value
+        return None
+
+
+class WindowRules:
+    # Resolves float state, target group and initial layout of a window in one
+    # lookup. Rules are indexed by their first plain string property, the
+    # window's properties then pick the candidates out of dicts and only
+    # pattern-only rules are scanned. Rules that need the window itself (func,
+    # pid) are checked per window. For each of the three decisions the first
+    # matching rule that makes it wins.
+
+    def __init__(self, rules, cache_size=1024):
+        self.rules = list(rules)
+        self._exact = defaultdict(lambda: defaultdict(list))
+        self._scan = []
+        self._opaque = []
+        for index, rule in enumerate(self.rules):
+            if rule.fields is None:
+                self._opaque.append(index)
+                continue
+            key = rule.index_key()
+            if key is None:
+                self._scan.append(index)
+            else:
+                field, value = key
+                self._exact[field][value].append(index)
+        self._matching_props = lru_cache(maxsize=cache_size)(self._match_props)
+        self.float_match = FloatMatch(self)
+
+    def _match_props(self, props):
+        candidates = set(self._scan)
+        for field, table in self._exact.items():
+            if field == 'wm_class':
+                for part in props.wm_class:
+                    candidates.update(table.get(part, ()))
+            else:
+                prop = _prop(props, field)
+                if prop is not None:
+                    candidates.update(table.get(prop, ()))
+        return tuple(sorted(
+            index for index in candidates if self.rules[index].matches_props(props)))
+
+    def resolve(self, window):
+        matching = self._matching_props(window_props(window))
+        opaque = [index for index in self._opaque if self.rules[index].match.compare(window)]
+        if opaque:
+            matching = sorted(matching + tuple(opaque))
+        float = group = layout = None
+        for index in matching:
+            rule = self.rules[index]
+            if float is None:
+                float = rule.float
+            if group is None:
+                group = rule.group
+            if layout is None:
+                layout = rule.layout
+            if float is not None and group is not None and layout is not None:
+                break
+        if float is group is layout is None:
+            return NO_PLACEMENT
+        return Placement(float, group, layout)
+
+    def place(self, window):
+        # For the client_new hook: moves the window to its group and gives an
+        # empty target group its initial layout. Floating is applied by qtile
+        # through float_match.
+        placement = self.resolve(window)
+        group = window.qtile.current_group
+        if placement.group is not None:
+            group = window.qtile.groups_map.get(placement.group, group)
+            window.togroup(placement.group)
+        if placement.layout is not None and not group.windows:
+            group.cmd_setlayout(placement.layout)
+        return placement
+
+
+class FloatMatch:
+    # Stands in for the whole float_rules list of layout.Floating.
+
+    def __init__(self, rules):
+        self.rules = rules
+
+    def compare(self, window):
+        return bool(self.rules.resolve(window).float)
+
+
+def float_rules(matches):
+    return [WindowRule(match, float=True) for match in matches]
+
+
+def benchmark(rules, matches, windows, rounds=20):
+    # Maps a burst of windows, like a restored session, through the indexed
+    # rules and through the linear float_rules scan they replace. The property
+    # cache is cleared every round, a restored session starts cold. Run with
+    # `python3 tests/test_rules.py [windows]`.
+    results = {}
+    for label, floats in (
+            ('linear', lambda w: any(match.compare(w) for match in matches)),
+            ('indexed', rules.float_match.compare)):
+        elapsed = 0
+        for _ in range(rounds):
+            rules._matching_props.cache_clear()
+            start = time.perf_counter()
+            for window in windows:
+                floats(window)
+            elapsed += time.perf_counter() - start
+        results[label] = elapsed / rounds
+    return results
@@ -1,5 +1,15 @@
 import tkinter as tk
 import tkinter.ttk as ttk
+import heapq
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from subprocess import Popen
+
+
+logger = logging.getLogger(__name__)
 
 
 class Searchable:
@@ -15,20 +25,342 @@ class Searchable:
         self.command = command
 
 
+def fuzzy_score(term, text):
+    # Scores `term` as a subsequence of `text`, None when it does not match.
+    # Contiguous matches score highest, then matches on word starts.
+    position = text.find(term)
+    if position >= 0:
+        word_start = position == 0 or not text[position - 1].isalnum()
+        return 100 + 20 * word_start - position / 100 - len(text) / 1000
+
+    score = 0
+    last = -1
+    for char in term:
+        found = text.find(char, last + 1)
+        if found < 0:
+            return None
+        if found == last + 1:
+            score += 5
+        if found == 0 or not text[found - 1].isalnum():
+            score += 3
+        last = found
+    return score - len(text) / 1000
+
+
+def iter_bits(bits):
+    digits = bin(bits)[:1:-1]
+    index = digits.find('1')
+    while index >= 0:
+        yield index
+        index = digits.find('1', index + 1)
+
+
+class SearchIndex:
+    # Posting lists are int bitsets over item positions, so narrowing a query
+    # is a handful of big-int ANDs. Matches are ranked in tiers: substring at a
+    # word start, substring anywhere, then fuzzy subsequence. Every candidate
+    # of a tier is scored and the best ones are kept, later tiers are only
+    # scored while `limit` is not filled. When the query only grows, the
+    # previous candidates are narrowed instead of starting from all items.
+
+    def __init__(self, items=None):
+        self.items = []
+        self._texts = []
+        self._padded = []
+        self._lengths = defaultdict(int)
+        self._all = 0
+        self._chars = defaultdict(int)
+        self._bigrams = defaultdict(int)
+        self._trigrams = defaultdict(int)
+        self._word_prefixes = defaultdict(int)
+        self._last = None
+        self.add(items or [])
+
+    def add(self, items):
+        for item in items:
+            bit = 1 << len(self.items)
+            self.items.append(item)
+            text = item.searchable_text
+            self._texts.append(text)
+            self._padded.append(' ' + text)
+            self._lengths[len(text)] |= bit
+            self._all |= bit
+            for char in set(text):
+                self._chars[char] |= bit
+            for bigram in {text[n:n+2] for n in range(len(text) - 1)}:
+                self._bigrams[bigram] |= bit
+            for trigram in {text[n:n+3] for n in range(len(text) - 2)}:
+                self._trigrams[trigram] |= bit
+            for word in set(text.split()):
+                for n in range(1, min(len(word), 3) + 1):
+                    self._word_prefixes[word[:n]] |= bit
+        self._last = None
+
+    def _all_of(self, index, keys):
+        bits = self._all
+        for key in keys:
+            bits &= index.get(key, 0)
+            if not bits:
+                break
+        return bits
+
+    def _substring_bits(self, term):
+        # Exact up to three characters, longer terms can match all their
+        # trigrams without containing the term.
+        if len(term) == 1:
+            return self._chars.get(term, 0)
+        if len(term) == 2:
+            return self._bigrams.get(term, 0)
+        return self._all_of(self._trigrams, {term[n:n+3] for n in range(len(term) - 2)})
+
+    def _tiers(self, terms, scope):
+        substring = scope
+        word_start = scope
+        for term in terms:
+            bits = self._substring_bits(term)
+            substring &= bits
+            word_start &= bits & self._word_prefixes.get(term[:3], 0)
+        fuzzy = scope & self._all_of(self._chars, ''.join(terms))
+        return [word_start, substring & ~word_start, fuzzy & ~substring]
+
+    def iter_search(self, query, limit=None, chunk_size=2000):
+        # Yields the best matches found so far every `chunk_size` scored
+        # candidates, so a superseded search can stop, and once more when the
+        # search is done.
+        terms = (query or '').lower().split()
+        if not terms:
+            yield self.items[:limit]
+            return
+
+        query = ' '.join(terms)
+        scope = self._all
+        if self._last and query.startswith(self._last[0]):
+            scope = self._last[1]
+        tiers = self._tiers(terms, scope)
+        self._last = (query, tiers[0] | tiers[1] | tiers[2])
+
+        texts = self._texts
+        matches = []
+        for tier, bits in enumerate(tiers):
+            need = None if limit is None else limit - len(matches)
+            if need is not None and need <= 0:
+                break
+            if tier < 2 and len(terms) == 1:
+                best, misses = self._substring_best(terms[0], bits, need)
+                matches.extend(best)
+                tiers[2] |= misses
+                continue
+            scored = []
+            for count, index in enumerate(iter_bits(bits), 1):
+                text = texts[index]
+                total = 0
+                for term in terms:
+                    score = fuzzy_score(term, text)
+                    if score is None:
+                        break
+                    total += score
+                else:
+                    scored.append((-total, index))
+                if count % chunk_size == 0:
+                    yield self._ranked(matches + self._best(scored, need))
+            matches.extend(self._best(scored, need))
+
+        yield self._ranked(matches)
+
+    def _substring_best(self, term, bits, limit):
+        # The best candidates of a substring tier by fuzzy_score, scaled to
+        # ints: ten per position plus the length, 20000 more inside a word.
+        # Texts are padded with a space so the character before a match is
+        # always there. Shorter texts are scored first and every key is at
+        # least ten plus the length, so once `limit` keys below that are kept
+        # the longer texts cannot get in. Candidates that do not contain the
+        # term are returned as bits for the fuzzy tier.
+        padded = self._padded
+        lengths = sorted(self._lengths)
+        best = []
+        misses = 0
+        for n, length in enumerate(lengths):
+            group = bits & self._lengths[length]
+            if not group:
+                continue
+            for index in iter_bits(group):
+                text = padded[index]
+                position = text.find(term)
+                if position < 0:
+                    misses |= 1 << index
+                    continue
+                best.append((10 * position + length + 20000 * text[position - 1].isalnum(),
+                             index))
+            if limit is not None and len(best) >= limit and n + 1 < len(lengths):
+                best = self._best(best, limit)
+                if best[-1][0] < 10 + lengths[n + 1]:
+                    break
+        return self._best(best, limit), misses
+
+    def _best(self, scored, limit):
+        # nsmallest only pays off when a small part of the candidates is kept.
+        if limit is None or limit * 4 >= len(scored):
+            return sorted(scored)[:limit]
+        return heapq.nsmallest(limit, scored)
+
+    def _ranked(self, matches):
+        return [self.items[index] for _, index in matches]
+
+    def search(self, query, limit=None):
+        results = []
+        for results in self.iter_search(query, limit, chunk_size=float('inf')):
+            pass
+        return results
+
+
+def benchmark(items=10000, limit=50, repeat=9,
+              queries=('f', 'fi', 'fir', 'fire', 'firefox', 'term', 'vol up', 'xyzq')):
+    # Times each query from scratch on an index of generated items, `python3
+    # searchbox.py --benchmark [items] [limit]`. Returns the median
+    # milliseconds per query.
+    import random
+
+    rng = random.Random(0)
+    words = ['firefox', 'terminal', 'volume', 'up', 'down', 'window', 'focus', 'move',
+             'group', 'layout', 'screen', 'brightness', 'mute', 'settings', 'files',
+             'editor', 'mail', 'music', 'player', 'next', 'previous', 'kill', 'float']
+    entries = [
+        Searchable(' '.join(rng.sample(words, 3)) + ' {}'.format(n), 'item {}'.format(n))
+        for n in range(items - 1)
+    ]
+    entries.append(Searchable('firefox', 'Web browser'))
+    index = SearchIndex(entries)
+    results = {}
+    for query in queries:
+        timings = []
+        for _ in range(repeat):
+            index._last = None
+            start = time.perf_counter()
+            index.search(query, limit)
+            timings.append((time.perf_counter() - start) * 1000)
+        results[query] = sorted(timings)[len(timings) // 2]
+    return results
+
+
+class SearchWorker:
+    # Runs searches on a background thread. Submitting a query supersedes the
+    # one in progress, which stops at its next partial result. Results go into
+    # a queue tagged with their generation for the Tk thread to pick up. Items
+    # from catalog sources are added to the index on this thread as well, so
+    # the index is never touched by two threads.
+
+    def __init__(self, index):
+        self.index = index
+        self.results = queue.Queue()
+        self.generation = 0
+        self.size = len(index.items)
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, query, limit=None):
+        self.generation += 1
+        self._requests.put(('search', (self.generation, query, limit)))
+        return self.generation
+
+    def add(self, items):
+        self._requests.put(('add', items))
+
+    def _run(self):
+        while True:
+            requests = [self._requests.get()]
+            while not self._requests.empty():
+                requests.append(self._requests.get_nowait())
+
+            search = None
+            for kind, request in requests:
+                if kind == 'add':
+                    self.index.add(request)
+                    self.size = len(self.index.items)
+                else:
+                    search = request
+            if search is None:
+                continue
+
+            generation, query, limit = search
+            if generation != self.generation:
+                continue
+            done = True
+            for results in self.index.iter_search(query, limit):
+                if generation != self.generation:
+                    done = False
+                    break
+                self.results.put((generation, results, False))
+            if done:
+                self.results.put((generation, None, True))
+
+
+def load_sources(sources, worker, batch_size=50):
+    # Feeds every source into the worker from a thread of its own, in batches,
+    # so fast sources show up without waiting for slow ones.
+
+    def _load(source):
+        batch = []
+        try:
+            for item in source.iter_items():
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    worker.add(batch)
+                    batch = []
+        except Exception:
+            logger.exception('Catalog source %s failed', type(source).__name__)
+        if batch:
+            worker.add(batch)
+
+    for source in sources:
+        threading.Thread(target=_load, args=(source,), daemon=True).start()
+
+
+def run_command(command):
+    if callable(command):
+        command()
+    elif command:
+        Popen(command, shell=True)
+
+
 class SearchBox(tk.Frame):
+    # The result list is a fixed pool of `visible_rows` label pairs. Filtering
+    # and scrolling only rebind their text, so the tk cost does not depend on
+    # how many items match.
 
-    def __init__(self, root, items: list[Searchable] = None):
+    def __init__(self, root, items: list[Searchable] = None, visible_rows=20, max_results=50,
+                 debounce_ms=60, poll_ms=16, sources=None):
         super().__init__(root, background='black')
+        self.root = root
         self.list_frame = tk.Frame(root, background='green')
         self.search_frame = tk.Frame(root)
         self.items = items or []
+        self.index = SearchIndex(self.items)
+        self.visible_rows = visible_rows
+        self.max_results = max_results
+        self.debounce_ms = debounce_ms
+        self.poll_ms = poll_ms
+        self.worker = SearchWorker(self.index)
+        self._pending_search = None
+        self._shown_generation = None
+        self._refresh_generation = None
+        self._indexed_size = self.worker.size
+
+        self.results = []
+        self.offset = 0
+        self.selected = 0
 
         self._bind_search()
 
         self.list_frame.columnconfigure(index=0, weight=2, pad=10)
         self.list_frame.columnconfigure(index=1, weight=3, pad=10)
 
+        self._create_rows()
+        self._bind_navigation()
+
         self.update_items_list(self.items)
+        self.after(self.poll_ms, self._poll_results)
+        load_sources(sources or [], self.worker)
 
 
     def _bind_search(self):
@@ -38,45 +370,159 @@ class SearchBox(tk.Frame):
 
         search_input = ttk.Entry(self.search_frame, textvariable=self.st_var)
         search_input.grid()
+        search_input.focus_set()
         
         self.search_frame.grid()
+
+
+    def _create_rows(self):
+        style = ttk.Style(self.root)
+        style.configure('Selected.TLabel', background='#feecee', foreground='black')
+
+        self.rows = []
+        for row in range(self.visible_rows):
+            label = ttk.Label(self.list_frame)
+            label.grid(row=row, column=0, sticky=tk.W)
+            desc = ttk.Label(self.list_frame)
+            desc.grid(row=row, column=1, sticky=tk.E)
+            for widget in (label, desc):
+                widget.bind('<Button-1>', lambda e, row=row: self._activate(self.offset + row))
+            self.rows.append((label, desc))
+
+        self.list_frame.grid()
+
+
+    def _bind_navigation(self):
+        self.root.bind('<Up>', lambda e: self._move(-1))
+        self.root.bind('<Down>', lambda e: self._move(1))
+        self.root.bind('<Prior>', lambda e: self._move(-self.visible_rows))
+        self.root.bind('<Next>', lambda e: self._move(self.visible_rows))
+        self.root.bind('<Return>', lambda e: self._activate(self.selected))
+        self.root.bind('<Escape>', lambda e: self.root.destroy())
+        self.root.bind('<Button-4>', lambda e: self._scroll(-1))
+        self.root.bind('<Button-5>', lambda e: self._scroll(1))
+        self.root.bind('<MouseWheel>', lambda e: self._scroll(-1 if e.delta > 0 else 1))
     
 
     def _on_search(self, *args):
+        if self._pending_search is not None:
+            self.after_cancel(self._pending_search)
+        self._pending_search = self.after(self.debounce_ms, self._submit_search)
+
+
+    def _submit_search(self, refresh=False):
+        # A refresh runs the shown query again over items sources added.
+        self._pending_search = None
         search_term = (self.st_var.get() or '').strip()
-        if search_term == '':
-            self.update_items_list(self.items)
-            return
-        
-        matching = []
-        for item in self.items:
-            if search_term.lower() in item.searchable_text:
-                matching.append(item)
-        
-        self.update_items_list(matching)
+        generation = self.worker.submit(search_term, limit=self.max_results)
+        self._refresh_generation = generation if refresh else None
+
+
+    def _poll_results(self):
+        latest = None
+        try:
+            while True:
+                generation, results, done = self.worker.results.get_nowait()
+                if generation == self.worker.generation and results is not None:
+                    latest = (generation, results)
+        except queue.Empty:
+            pass
+
+        if self.worker.size != self._indexed_size:
+            # Sources added items, show them for the current query.
+            self._indexed_size = self.worker.size
+            if self._pending_search is None:
+                self._pending_search = self.after(self.debounce_ms, self._submit_search, True)
+
+        if latest is not None:
+            generation, results = latest
+            if generation == self._shown_generation:
+                # A partial result of the shown search grew, keep the selection.
+                self.results = results
+                self._render_rows()
+            elif generation == self._refresh_generation:
+                self._shown_generation = generation
+                self._refresh_items_list(results)
+            else:
+                self._shown_generation = generation
+                self.update_items_list(results)
+
+        self.after(self.poll_ms, self._poll_results)
 
 
     def update_items_list(self, items: list[Searchable]):
-        for child in self.list_frame.winfo_children():
-            child.destroy()
-        
-        for row, item in enumerate(items):
-            label = ttk.Label(self.list_frame, text=item.label + ': ')
-            label.grid(row=row, column=0, sticky=tk.W)
-            desc = ttk.Label(self.list_frame, text=item.desc)
-            desc.grid(row=row, column=1, sticky=tk.E)
+        self.results = items
+        self.offset = 0
+        self.selected = 0
+        self._render_rows()
+
+
+    def _refresh_items_list(self, items: list[Searchable]):
+        # The selected item stays selected on the same row when it is still
+        # among the results, otherwise the selection keeps its position.
+        row = self.selected - self.offset
+        selected = self.results[self.selected] if self.selected < len(self.results) else None
+        self.results = items
+        index = next((n for n, item in enumerate(items) if item is selected), None)
+        if index is None:
+            index = max(0, min(self.selected, len(items) - 1))
+        self.selected = index
+        self.offset = max(0, min(index - row, len(items) - self.visible_rows))
+        self._render_rows()
 
-        self.list_frame.grid()
+
+    def _render_rows(self):
+        for row, (label, desc) in enumerate(self.rows):
+            index = self.offset + row
+            if index < len(self.results):
+                item = self.results[index]
+                style = 'Selected.TLabel' if index == self.selected else 'TLabel'
+                label.configure(text=item.label + ': ', style=style)
+                desc.configure(text=item.desc, style=style)
+            else:
+                label.configure(text='', style='TLabel')
+                desc.configure(text='', style='TLabel')
+
+
+    def _move(self, delta):
+        if not self.results:
+            return
+        self.selected = max(0, min(len(self.results) - 1, self.selected + delta))
+        if self.selected < self.offset:
+            self.offset = self.selected
+        elif self.selected >= self.offset + self.visible_rows:
+            self.offset = self.selected - self.visible_rows + 1
+        self._render_rows()
+
+
+    def _scroll(self, delta):
+        last_offset = max(0, len(self.results) - self.visible_rows)
+        offset = max(0, min(last_offset, self.offset + delta))
+        if offset != self.offset:
+            self.offset = offset
+            self._render_rows()
+
+
+    def _activate(self, index):
+        if index >= len(self.results):
+            return
+        command = self.results[index].command
+        if command:
+            self.root.destroy()
+            run_command(command)
 
 
 def run_searchbox_window():
+    from sources import KeysSource, DesktopEntriesSource, WindowsSource
+
     root = tk.Tk()
     root.title('Key Bindings')
     root.resizable(0, 0)
     
-    sb = SearchBox(root, [
-        Searchable('[Ctrl] + [Alt] + Del', 'Restart.'),
-        Searchable('[Ctrl] + [Shift] + Del', 'Does something.'),
+    sb = SearchBox(root, sources=[
+        KeysSource(),
+        WindowsSource(),
+        DesktopEntriesSource(),
     ])
 
     sb.grid()
@@ -86,4 +532,11 @@ def run_searchbox_window():
 
 
 if __name__ == '__main__':
-    run_searchbox_window()
+    import sys
+
+    if sys.argv[1:2] == ['--benchmark']:
+        args = [int(arg) for arg in sys.argv[2:4]]
+        for query, ms in benchmark(*args).items():
+            print('{:10} {:8.3f} ms'.format(query, ms))
+    else:
+        run_searchbox_window()
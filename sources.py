@@ -0,0 +1,150 @@
+import configparser
+import json
+import os
+import re
+from functools import partial
+
+from catalog import CATALOG_PATH, read_catalog
+from ipc import QtileClient, dispatch
+from searchbox import Searchable
+
+
+CACHE_DIR = os.path.expanduser('~/.cache/qtile')
+
+DESKTOP_DIRS = [
+    os.path.expanduser('~/.local/share/applications'),
+    '/usr/local/share/applications',
+    '/usr/share/applications',
+]
+
+# Field codes in desktop entry Exec lines, e.g. %U
+EXEC_FIELD_CODE_RE = re.compile(r'\s*%[a-zA-Z]')
+
+
+class CatalogSource:
+    # Produces Searchable items for the SearchBox. iter_items() is a generator
+    # and is consumed on a background thread, so it may block.
+
+    def iter_items(self):
+        raise NotImplementedError()
+
+
+class CachedSource(CatalogSource):
+    # Stores the scanned items on disk and reuses them while the mtimes of
+    # watched_paths() are unchanged. Items are (label, desc, search_terms,
+    # command) tuples, the command being a shell command string.
+
+    cache_name = None
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_path = os.path.join(cache_dir, self.cache_name)
+
+    def watched_paths(self):
+        return []
+
+    def scan(self):
+        raise NotImplementedError()
+
+    def _mtimes(self):
+        mtimes = {}
+        for path in self.watched_paths():
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except FileNotFoundError:
+                mtimes[path] = None
+        return mtimes
+
+    def iter_items(self):
+        mtimes = self._mtimes()
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+            if cache['mtimes'] == mtimes:
+                for entry in cache['items']:
+                    yield Searchable(*entry)
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+
+        entries = []
+        for entry in self.scan():
+            entries.append(entry)
+            yield Searchable(*entry)
+
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        with open(self.cache_path + '.tmp', 'w') as f:
+            json.dump({'mtimes': mtimes, 'items': entries}, f)
+        os.replace(self.cache_path + '.tmp', self.cache_path)
+
+
+class KeysSource(CatalogSource):
+    # The key bindings from the catalog config.py writes on every load.
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+
+    def iter_items(self):
+        for label, desc, calls in read_catalog(self.path):
+            command = partial(dispatch, calls) if calls else None
+            yield Searchable(label, desc, command=command)
+
+
+class DesktopEntriesSource(CachedSource):
+    # Applications from .desktop files. Directory mtimes change whenever an
+    # application is installed or removed, which invalidates the cache.
+
+    cache_name = 'desktop_entries.json'
+
+    def __init__(self, dirs=None, **config):
+        super().__init__(**config)
+        self.dirs = dirs or DESKTOP_DIRS
+
+    def watched_paths(self):
+        return list(self.dirs)
+
+    def scan(self):
+        for directory in self.dirs:
+            try:
+                names = sorted(os.listdir(directory))
+            except FileNotFoundError:
+                continue
+            for name in names:
+                if name.endswith('.desktop'):
+                    entry = self._read_entry(os.path.join(directory, name))
+                    if entry:
+                        yield entry
+
+    def _read_entry(self, path):
+        parser = configparser.ConfigParser(interpolation=None, strict=False)
+        try:
+            parser.read(path, encoding='utf-8')
+            entry = parser['Desktop Entry']
+        except (configparser.Error, UnicodeDecodeError, KeyError):
+            return None
+        if entry.get('NoDisplay') == 'true' or entry.get('Hidden') == 'true' or 'Exec' not in entry:
+            return None
+        command = EXEC_FIELD_CODE_RE.sub('', entry['Exec'])
+        return (
+            entry.get('Name', os.path.basename(path)),
+            entry.get('Comment', ''),
+            ' '.join([entry.get('GenericName', ''), entry.get('Keywords', '').replace(';', ' ')]),
+            command,
+        )
+
+
+class WindowsSource(CatalogSource):
+    # The windows currently managed by qtile.
+
+    def iter_items(self):
+        for window in QtileClient().call([], 'windows'):
+            wm_class = ' '.join(window.get('wm_class') or [])
+            command = partial(dispatch, [
+                [[['group', window['group']]], 'toscreen', [], {}],
+                [[['window', window['id']]], 'focus', [], {}],
+            ])
+            yield Searchable(
+                window['name'],
+                'Window on group {}'.format(window['group']),
+                wm_class,
+                command=command,
+            )
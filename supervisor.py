@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import time
+from subprocess import DEVNULL
+
+# qtile's logger, without importing qtile.
+logger = logging.getLogger('libqtile')
+
+
+REPORT_PATH = os.path.expanduser('~/.cache/qtile/autostart-report.txt')
+
+
+class Service:
+    # A program started by the Supervisor. Daemons count as started once their
+    # `ready` probe passes (right after spawning when there is none) and are
+    # skipped when a process with the same name already runs, e.g. after a
+    # qtile restart. Oneshot services are started once the services they
+    # require are up and are done when they exit.
+
+    def __init__(self, name, command, requires=(), ready=None, oneshot=False,
+                 process_name=None, ready_timeout=10.0):
+        self.name = name
+        self.command = command
+        self.requires = tuple(requires)
+        self.ready = ready
+        self.oneshot = oneshot
+        self.process_name = process_name or os.path.basename(command[0])
+        self.ready_timeout = ready_timeout
+
+
+def running_processes(proc_dir='/proc'):
+    # Names of all running processes. /proc/<pid>/comm holds at most 15
+    # characters of the name.
+    names = set()
+    for pid in os.listdir(proc_dir):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(os.path.join(proc_dir, pid, 'comm')) as f:
+                names.add(f.read().strip())
+        except OSError:
+            continue
+    return names
+
+
+def process_running(name, proc_dir='/proc'):
+    return name[:15] in running_processes(proc_dir)
+
+
+def command_succeeds(*command):
+    # Readiness probe passing once the command exits with status 0.
+    async def probe():
+        process = await asyncio.create_subprocess_exec(*command, stdout=DEVNULL, stderr=DEVNULL)
+        return await process.wait() == 0
+    return probe
+
+
+def process_started(name, proc_dir='/proc'):
+    async def probe():
+        return process_running(name, proc_dir)
+    return probe
+
+
+async def wait_until(probe, timeout, interval=0.1):
+    deadline = time.monotonic() + timeout
+    while not await probe():
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(interval)
+    return True
+
+
+class Supervisor:
+    # Starts services in parallel on the running event loop, each as soon as
+    # the services it requires are up, and records how long every one took.
+
+    def __init__(self, services, proc_dir='/proc', report_path=REPORT_PATH):
+        self.services = {service.name: service for service in services}
+        self.proc_dir = proc_dir
+        self.report_path = report_path
+        self.results = {}
+        self._started = {name: asyncio.Event() for name in self.services}
+        self._processes = []
+        self._running = set()
+
+    async def start(self):
+        begin = time.monotonic()
+        # One scan of /proc for all daemons, off the event loop.
+        self._running = await asyncio.get_event_loop().run_in_executor(
+            None, running_processes, self.proc_dir)
+        await asyncio.gather(*[self._start(service) for service in self.services.values()])
+        self.total = time.monotonic() - begin
+        self._write_report()
+        return self.results
+
+    async def _start(self, service):
+        try:
+            for name in service.requires:
+                await self._started[name].wait()
+            failed = [name for name in service.requires if self.results[name][0] not in ('started', 'running', 'done')]
+            if failed:
+                self.results[service.name] = ('skipped', 0.0, 'requires ' + ', '.join(failed))
+                return
+
+            begin = time.monotonic()
+            status, detail = await self._launch(service)
+            self.results[service.name] = (status, time.monotonic() - begin, detail)
+        except Exception as e:
+            logger.exception(e)
+            self.results[service.name] = ('failed', 0.0, str(e))
+        finally:
+            self._started[service.name].set()
+
+    async def _launch(self, service):
+        if not service.oneshot and service.process_name[:15] in self._running:
+            return 'running', ''
+
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *service.command, stdout=DEVNULL, stderr=DEVNULL, start_new_session=True)
+        except OSError as e:
+            return 'failed', str(e)
+
+        if service.oneshot:
+            code = await process.wait()
+            return ('done', '') if code == 0 else ('failed', 'exit status {}'.format(code))
+
+        # Keep a reference so the daemon is reaped whenever it exits.
+        self._processes.append(asyncio.ensure_future(process.wait()))
+        if service.ready and not await wait_until(service.ready, service.ready_timeout):
+            return 'failed', 'not ready after {:.0f}s'.format(service.ready_timeout)
+        return 'started', ''
+
+    def report(self):
+        lines = ['{:<24} {:<8} {:>9}'.format('service', 'status', 'ms')]
+        for name, (status, seconds, detail) in sorted(self.results.items(), key=lambda r: -r[1][1]):
+            lines.append('{:<24} {:<8} {:>9.1f}  {}'.format(name, status, seconds * 1000, detail).rstrip())
+        lines.append('total {:.1f} ms'.format(self.total * 1000))
+        return '\n'.join(lines)
+
+    def _write_report(self):
+        report = self.report()
+        logger.info('Autostart:\n%s', report)
+        try:
+            os.makedirs(os.path.dirname(self.report_path), exist_ok=True)
+            with open(self.report_path, 'w') as f:
+                f.write(report + '\n')
+        except OSError as e:
+            logger.warning('Could not write the autostart report: %s', e)
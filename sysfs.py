@@ -0,0 +1,135 @@
+import os
+from collections import namedtuple
+
+
+# Reading /sys for the battery and backlight widgets in mods.py, and the
+# decisions they take from what they read. Nothing here needs qtile.
+
+def read_sysfs(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def read_sysfs_int(path, default=None):
+    try:
+        return int(read_sysfs(path))
+    except (TypeError, ValueError):
+        return default
+
+
+BatteryState = namedtuple('BatteryState', 'status percent hours watt on_ac')
+
+
+def power_supplies(root, kind):
+    base_dir = os.path.join(root, 'class', 'power_supply')
+    try:
+        names = sorted(os.listdir(base_dir))
+    except OSError:
+        return []
+    return [
+        os.path.join(base_dir, name) for name in names
+        if read_sysfs(os.path.join(base_dir, name, 'type')) == kind
+    ]
+
+
+def read_battery(root, battery_name=None):
+    # Blocking, ACPI batteries can take a while to answer.
+    if battery_name is None:
+        batteries = power_supplies(root, 'Battery')
+        if not batteries:
+            return None
+        path = batteries[0]
+    else:
+        path = os.path.join(root, 'class', 'power_supply', battery_name)
+
+    def value(name):
+        return read_sysfs_int(os.path.join(path, name))
+
+    status = read_sysfs(os.path.join(path, 'status'))
+    if status is None:
+        return None
+    now, full, rate = value('energy_now'), value('energy_full'), value('power_now')
+    watt = rate / 1e6 if rate is not None else None
+    if now is None:
+        now, full, rate = value('charge_now'), value('charge_full'), value('current_now')
+        voltage = value('voltage_now')
+        watt = rate * voltage / 1e12 if rate is not None and voltage is not None else None
+    if now is not None and full:
+        percent = min(1.0, now / full)
+    else:
+        percent = (value('capacity') or 0) / 100
+
+    hours = None
+    if rate:
+        if status == 'Discharging' and now is not None:
+            hours = now / abs(rate)
+        elif status == 'Charging' and now is not None and full:
+            hours = (full - now) / abs(rate)
+
+    mains = power_supplies(root, 'Mains')
+    if mains:
+        on_ac = any(read_sysfs(os.path.join(m, 'online')) == '1' for m in mains)
+    else:
+        on_ac = status != 'Discharging'
+    return BatteryState(status, percent, hours, watt, on_ac)
+
+
+class BatteryIntervals:
+    # Seconds until the next battery read: `interval` on battery, `slow` on AC
+    # once the status is steady and `fast` for `fast_reads` reads after the
+    # status or the AC adapter changed, or after changed().
+
+    def __init__(self, interval=60, slow=300, fast=2, fast_reads=5):
+        self.interval = interval
+        self.slow = slow
+        self.fast = fast
+        self.fast_reads = fast_reads
+        self.fast_reads_left = 0
+
+    def changed(self):
+        self.fast_reads_left = self.fast_reads
+
+    def next(self, previous, state):
+        if previous is not None and state is not None and (
+                state.status != previous.status or state.on_ac != previous.on_ac):
+            self.changed()
+        if self.fast_reads_left > 0:
+            self.fast_reads_left -= 1
+            return self.fast
+        if state is not None and state.on_ac and state.status != 'Charging':
+            return self.slow
+        return self.interval
+
+
+class BacklightLevel:
+    # The brightness the backlight widget shows, as a fraction, and the burst
+    # of steps taken from it. `applied` is the target handed to a change
+    # command, it stands in for `percent` until sysfs reports the new
+    # brightness.
+
+    def __init__(self, min_brightness=5):
+        self.min_brightness = min_brightness
+        self.percent = None
+        self.applied = None
+        self.burst_start = None
+
+    def read(self, percent):
+        self.applied = None
+        self.percent = percent
+
+    def start_burst(self):
+        if self.burst_start is None:
+            current = self.percent if self.applied is None else self.applied
+            self.burst_start = current * 100
+
+    def target(self, delta):
+        # Whole percent between min_brightness and 100.
+        return max(self.min_brightness, min(100, round(self.burst_start + delta)))
+
+    def end_burst(self, delta):
+        target = self.target(delta)
+        self.burst_start = None
+        return target
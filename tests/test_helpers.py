@@ -0,0 +1,175 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import (  # noqa: E402
+    CircuitBreaker, CommandUnavailable, KeyboardLayoutStore, ScheduledCall, TickScheduler,
+)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_after_threshold_and_backs_off():
+    clock = FakeClock()
+    breaker = CircuitBreaker(threshold=2, backoff=5, max_backoff=20, clock=clock)
+
+    breaker.failure('pamixer')
+    breaker.check('pamixer')
+    breaker.failure('pamixer')
+    with pytest.raises(CommandUnavailable):
+        breaker.check('pamixer')
+
+    clock.now = 5
+    breaker.check('pamixer')
+    breaker.failure('pamixer')
+    clock.now = 14
+    with pytest.raises(CommandUnavailable):
+        breaker.check('pamixer')
+
+
+def test_breaker_success_resets():
+    clock = FakeClock()
+    breaker = CircuitBreaker(threshold=1, clock=clock)
+
+    breaker.failure('pactl')
+    breaker.success('pactl')
+    breaker.check('pactl')
+
+
+def test_layout_store_replays_log(tmp_path):
+    path = str(tmp_path / 'layouts.tsv')
+    store = KeyboardLayoutStore(path)
+    store.remember(1, 'terminator', 'mk')
+    store.remember(2, 'firefox', 'us')
+    store.forget_window(1)
+
+    store = KeyboardLayoutStore(path)
+    assert store.lookup(1) is None
+    assert store.lookup(2) == 'us'
+    assert store.lookup(3, 'terminator') == 'mk'
+
+
+def test_layout_store_compacts(tmp_path):
+    path = str(tmp_path / 'layouts.tsv')
+    store = KeyboardLayoutStore(path, compact_after=4)
+    for wid in range(5):
+        store.remember(wid, 'terminator', 'mk')
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == len(store.windows) + len(store.classes)
+    assert KeyboardLayoutStore(path).windows == store.windows
+
+
+def test_layout_store_retains_live_windows(tmp_path):
+    path = str(tmp_path / 'layouts.tsv')
+    store = KeyboardLayoutStore(path)
+    store.remember(1, 'terminator', 'mk')
+    store.remember(2, 'firefox', 'mk')
+
+    store.retain_windows({2: object()})
+    store = KeyboardLayoutStore(path)
+    assert store.lookup(1) is None
+    assert store.lookup(2) == 'mk'
+
+
+class FakeBar:
+
+    def __init__(self):
+        self.window = object()
+        self.draws = 0
+
+    def draw(self):
+        self.draws += 1
+
+
+class FakeTextWidget:
+    # Text is laid out one pixel per character.
+
+    def __init__(self, bar, text=''):
+        self.bar = bar
+        self.layout = SimpleNamespace(width=len(text))
+        self._text = text
+        self.draws = 0
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        self._text = value
+        self.layout.width = len(value)
+
+    def draw(self):
+        self.draws += 1
+
+
+def run_tick(scheduler, *fns):
+    scheduler._run([ScheduledCall(fn, None, 0) for fn in fns])
+
+
+def test_tick_draws_widgets_whose_width_is_unchanged():
+    scheduler = TickScheduler()
+    bar = FakeBar()
+    clock = FakeTextWidget(bar, '12:00')
+    battery = FakeTextWidget(bar, '80%')
+
+    run_tick(scheduler,
+             lambda: scheduler.update(clock, '12:01'),
+             lambda: scheduler.update(battery, '79%'))
+
+    assert (bar.draws, clock.draws, battery.draws) == (0, 1, 1)
+    assert clock.text == '12:01'
+
+
+def test_tick_draws_bar_once_when_a_width_changes():
+    scheduler = TickScheduler()
+    bar = FakeBar()
+    clock = FakeTextWidget(bar, '12:00')
+    battery = FakeTextWidget(bar, '100%')
+
+    run_tick(scheduler,
+             lambda: scheduler.update(clock, '12:01'),
+             lambda: scheduler.update(battery, '99%'),
+             lambda: scheduler.update(clock, '12:01'))
+
+    assert (bar.draws, clock.draws, battery.draws) == (1, 0, 0)
+    assert scheduler.bar_draws == 1
+
+
+def test_tick_skips_unchanged_text():
+    scheduler = TickScheduler()
+    bar = FakeBar()
+    clock = FakeTextWidget(bar, '12:00')
+
+    run_tick(scheduler, lambda: scheduler.update(clock, '12:00'))
+
+    assert (bar.draws, clock.draws) == (0, 0)
+
+
+def test_update_outside_a_tick_waits_for_the_next_one():
+    async def main():
+        scheduler = TickScheduler(resolution=0.05)
+        bar = FakeBar()
+        battery = FakeTextWidget(bar, '80%')
+        scheduler.update(battery, '79%')
+        scheduler.update(battery, '78%')
+        assert battery.draws == 0
+        await asyncio.sleep(0.1)
+        return battery
+
+    battery = asyncio.run(main())
+    assert (battery.text, battery.draws) == ('78%', 1)
@@ -0,0 +1,89 @@
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ipc import IPCError, QtileClient, dispatch, pack, unpack  # noqa: E402
+
+
+class FakeQtile:
+    # Answers every connection on a thread of its own like qtile's IPC
+    # server, so calls sent before an answer could run in any order.
+
+    def __init__(self, path, delays=None):
+        self.path = path
+        self.delays = delays or {}
+        self.handled = []
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            chunks = []
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            selectors, name, args, kwargs = unpack(b''.join(chunks))
+            time.sleep(self.delays.get(name, 0))
+            self.handled.append((selectors, name, args))
+            if name == 'fail':
+                conn.sendall(pack((1, 'No such command')))
+            else:
+                conn.sendall(pack((0, [name, list(args)])))
+
+    def close(self):
+        self.server.close()
+
+
+@pytest.fixture
+def qtile(tmp_path):
+    server = FakeQtile(str(tmp_path / 'qtilesocket'), delays={'toscreen': 0.1})
+    yield server
+    server.close()
+
+
+def test_call_returns_the_result(qtile):
+    client = QtileClient(qtile.path)
+    assert client.call([['group', '2']], 'toscreen') == ['toscreen', []]
+    assert qtile.handled == [([('group', '2')], 'toscreen', ())]
+
+
+def test_call_many_runs_calls_in_order(qtile):
+    results = QtileClient(qtile.path).call_many([
+        [[['group', '2']], 'toscreen', [], {}],
+        [[['window', 7]], 'focus', [], {}],
+    ])
+    assert results == [['toscreen', []], ['focus', []]]
+    assert [name for _, name, _ in qtile.handled] == ['toscreen', 'focus']
+
+
+def test_error_status_raises(qtile):
+    with pytest.raises(IPCError):
+        QtileClient(qtile.path).call([], 'fail')
+
+
+def test_dispatch_takes_catalog_json(qtile):
+    results = dispatch('[[[], "spawn", ["xterm"], {}]]', QtileClient(qtile.path))
+    assert results == [['spawn', ['xterm']]]
+
+
+def test_missing_socket_raises_oserror(tmp_path):
+    with pytest.raises(OSError):
+        QtileClient(str(tmp_path / 'missing')).call([], 'status')
@@ -0,0 +1,120 @@
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rules import NO_PLACEMENT, Placement, WindowRule, WindowRules, benchmark, float_rules  # noqa: E402
+
+
+class FakeWindow:
+
+    def __init__(self, wm_class, name, role=None, wm_type='normal'):
+        self.wm_class = wm_class
+        self.name = name
+        self.role = role
+        self.wm_type = wm_type
+
+    def get_wm_class(self):
+        return self.wm_class
+
+    def get_wm_role(self):
+        return self.role
+
+    def get_wm_type(self):
+        return self.wm_type
+
+    def get_pid(self):
+        return None
+
+    def has_fixed_size(self):
+        return False
+
+    def has_fixed_ratio(self):
+        return False
+
+
+class FakeMatch:
+    # The parts of libqtile.config.Match a WindowRule reads.
+
+    def __init__(self, compare=None, **rules):
+        self._rules = rules
+        self._compare = compare
+
+    def compare(self, window):
+        return self._compare(window)
+
+
+def make_burst(windows=500, seed=0):
+    rng = random.Random(seed)
+    names = ['terminator', 'firefox', 'code', 'pavucontrol', 'gitk', 'nautilus', 'slack']
+    return [
+        FakeWindow([name, name.capitalize()], '{} - window {}'.format(name, i),
+                   wm_type=rng.choice(['normal'] * 9 + ['dialog']))
+        for i, name in enumerate(rng.choice(names) for _ in range(windows))
+    ]
+
+
+def test_rules_resolve_float_group_and_layout():
+    rules = WindowRules([
+        WindowRule(FakeMatch(wm_class='gitk'), float=True),
+        WindowRule(FakeMatch(title=re.compile('^Picture-in-Picture$')), float=True, group='9'),
+        WindowRule(FakeMatch(wm_class='firefox'), group='2', layout='max'),
+    ])
+
+    assert rules.resolve(FakeWindow(['gitk', 'Gitk'], 'gitk')) == Placement(True, None, None)
+    assert rules.resolve(FakeWindow(['Navigator', 'firefox'], 'Mozilla Firefox')) == \
+        Placement(None, '2', 'max')
+    assert rules.resolve(FakeWindow(['Navigator', 'firefox'], 'Picture-in-Picture')) == \
+        Placement(True, '9', 'max')
+    assert rules.resolve(FakeWindow(['xterm', 'XTerm'], 'xterm')) is NO_PLACEMENT
+
+
+def test_first_rule_making_a_decision_wins():
+    rules = WindowRules([
+        WindowRule(FakeMatch(wm_class='code'), float=False),
+        WindowRule(FakeMatch(wm_class='code', wm_type='dialog'), float=True, group='3'),
+    ])
+
+    assert rules.resolve(FakeWindow(['code', 'Code'], 'x', wm_type='dialog')) == \
+        Placement(False, '3', None)
+    assert rules.resolve(FakeWindow(['code', 'Code'], 'x')) == Placement(False, None, None)
+
+
+def test_rules_needing_the_window_are_compared():
+    seen = []
+
+    def compare(window):
+        seen.append(window)
+        return window.name == 'pinentry'
+
+    rules = WindowRules(float_rules([FakeMatch(compare, func=compare)]))
+    window = FakeWindow(['gcr-prompter', 'Gcr-prompter'], 'pinentry')
+
+    assert rules.float_match.compare(window)
+    assert seen == [window]
+
+
+def test_burst_is_reproducible():
+    first, second = make_burst(50), make_burst(50)
+    assert [(w.wm_class, w.wm_type) for w in first] == [(w.wm_class, w.wm_type) for w in second]
+
+
+if __name__ == '__main__':
+    # `python3 tests/test_rules.py [windows]` times the default float rules.
+    from libqtile.config import Match
+    from libqtile.layout import Floating
+
+    windows = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    matches = [
+        *Floating.default_float_rules,
+        *[Match(wm_class=name) for name in
+          ('confirmreset', 'makebranch', 'maketag', 'ssh-askpass', 'pavucontrol')],
+        Match(title='branchdialog'),
+        Match(title='pinentry'),
+        Match(title=re.compile('^Picture-in-Picture$')),
+    ]
+    results = benchmark(WindowRules(float_rules(matches)), matches, make_burst(windows))
+    for label, seconds in results.items():
+        print('{:8} {:8.3f} ms per {} windows'.format(label, seconds * 1000, windows))
@@ -0,0 +1,51 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from searchbox import Searchable, SearchIndex  # noqa: E402
+
+
+def labels(results):
+    return [item.label for item in results]
+
+
+@pytest.fixture
+def index():
+    return SearchIndex([
+        Searchable('volume up'),
+        Searchable('mute'),
+        Searchable('backlight down'),
+        Searchable('abcxbcd'),
+    ])
+
+
+def test_two_character_query_needs_the_substring(index):
+    assert labels(index.search('um')) == ['volume up']
+    assert labels(index.search('od')) == []
+    assert labels(index.search('ow')) == ['backlight down']
+
+
+def test_trigram_hit_without_substring_is_fuzzy(index):
+    index.add([Searchable('abcd tools')])
+    assert labels(index.search('abcd')) == ['abcd tools', 'abcxbcd']
+
+
+def test_word_start_ranks_first():
+    index = SearchIndex([Searchable('gimp firefox plugin'), Searchable('firefox')])
+    assert labels(index.search('fire')) == ['firefox', 'gimp firefox plugin']
+
+
+@pytest.mark.parametrize('query', ['f', 'fi', 'fire', 'um', 'term', 'vol up'])
+def test_limit_keeps_the_best_matches(query):
+    rng = random.Random(0)
+    words = ['firefox', 'terminal', 'volume', 'up', 'window', 'focus', 'mute', 'files']
+    index = SearchIndex([
+        Searchable(' '.join(rng.sample(words, rng.randint(1, 4))), 'item {}'.format(n))
+        for n in range(2000)
+    ])
+    everything = index.search(query)
+    assert index.search(query, 20) == everything[:20]
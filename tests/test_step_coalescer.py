@@ -0,0 +1,116 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import StepCoalescer  # noqa: E402
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+        self.timers = []
+
+    def call_later(self, delay, fn):
+        timer = FakeTimer(self.now + delay, fn)
+        self.timers.append(timer)
+        return timer
+
+    def advance_to(self, when):
+        while True:
+            due = [t for t in self.timers if not t.cancelled and t.when <= when]
+            if not due:
+                break
+            timer = min(due, key=lambda t: t.when)
+            self.timers.remove(timer)
+            self.now = timer.when
+            timer.fn()
+        self.now = when
+
+
+class FakeTimer:
+
+    def __init__(self, when, fn):
+        self.when = when
+        self.fn = fn
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def key_repeat(clock, coalescer, step, rate, seconds):
+    # Presses the key `rate` times per second, like X auto-repeat.
+    presses = int(rate * seconds)
+    times = []
+    for i in range(presses):
+        clock.advance_to(i / rate)
+        times.append(clock.now)
+        coalescer.push(step)
+    return times
+
+
+@pytest.mark.parametrize('rate', [25, 40])
+def test_key_repeat_burst_applies_net_delta_within_window(rate):
+    clock = FakeClock()
+    applied = []
+    shown = []
+    coalescer = StepCoalescer(
+        lambda delta: applied.append((clock.now, delta)),
+        on_pending=lambda delta: shown.append((clock.now, delta)),
+        window=0.15,
+        call_later=clock.call_later,
+    )
+
+    presses = key_repeat(clock, coalescer, 5, rate, 1.0)
+    clock.advance_to(2.0)
+
+    # The pending target is shown on every press without waiting.
+    assert [when for when, _ in shown] == presses
+    # Every press is applied exactly once, in far fewer commands than presses.
+    assert sum(delta for _, delta in applied) == 5 * len(presses)
+    assert len(applied) <= 1.0 / 0.15 + 1 < len(presses)
+    # No press waits longer than the window to be applied.
+    for pressed in presses:
+        apply_time = min(when for when, _ in applied if when >= pressed)
+        assert apply_time - pressed <= 0.15 + 1e-9
+
+
+def test_single_press_is_applied_once_after_window():
+    clock = FakeClock()
+    applied = []
+    coalescer = StepCoalescer(applied.append, window=0.15, call_later=clock.call_later)
+
+    coalescer.push(-5)
+    clock.advance_to(0.1)
+    assert applied == []
+    clock.advance_to(0.2)
+    assert applied == [-5]
+    assert coalescer.pending == 0
+
+
+def test_opposite_steps_cancel_out():
+    clock = FakeClock()
+    applied = []
+    coalescer = StepCoalescer(applied.append, window=0.15, call_later=clock.call_later)
+
+    coalescer.push(5)
+    coalescer.push(-5)
+    clock.advance_to(1.0)
+    assert applied == []
+
+
+def test_flush_applies_pending_steps_immediately():
+    clock = FakeClock()
+    applied = []
+    coalescer = StepCoalescer(applied.append, window=0.15, call_later=clock.call_later)
+
+    coalescer.push(5)
+    coalescer.push(5)
+    coalescer.flush()
+    assert applied == [10]
+    clock.advance_to(1.0)
+    assert applied == [10]
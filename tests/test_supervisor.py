@@ -0,0 +1,90 @@
+import asyncio
+import os
+import stat
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from supervisor import Service, Supervisor, process_running  # noqa: E402
+
+
+@pytest.fixture
+def proc_dir(tmp_path):
+    # A /proc with a running nitrogen and a kernel thread without comm.
+    proc = tmp_path / 'proc'
+    (proc / '1').mkdir(parents=True)
+    (proc / '1' / 'comm').write_text('nitrogen\n')
+    (proc / '2').mkdir()
+    (proc / 'self').mkdir()
+    return str(proc)
+
+
+@pytest.fixture
+def stub(tmp_path):
+    # Writes an executable shell script, every run appends its name to a log.
+    log = tmp_path / 'ran.log'
+
+    def make(name, body='exit 0'):
+        path = tmp_path / 'bin' / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_text('#!/bin/sh\necho {} >> {}\n{}\n'.format(name, log, body))
+        path.chmod(path.stat().st_mode | stat.S_IXUSR)
+        return str(path)
+
+    make.ran = lambda: log.read_text().split() if log.exists() else []
+    return make
+
+
+def start(services, proc_dir, tmp_path):
+    supervisor = Supervisor(services, proc_dir=proc_dir,
+                            report_path=str(tmp_path / 'report' / 'autostart.txt'))
+    return supervisor, asyncio.run(supervisor.start())
+
+
+def test_process_running(proc_dir):
+    assert process_running('nitrogen', proc_dir)
+    assert not process_running('parcellite', proc_dir)
+
+
+def test_running_daemon_is_not_started_again(proc_dir, stub, tmp_path):
+    _, results = start([Service('wallpaper', [stub('nitrogen')])], proc_dir, tmp_path)
+
+    assert results['wallpaper'][0] == 'running'
+    assert stub.ran() == []
+
+
+def test_oneshots_run_after_what_they_require(proc_dir, stub, tmp_path):
+    services = [
+        Service('screens', [stub('screens', 'sleep 0.1')], oneshot=True),
+        Service('wallpaper', [stub('wallpaper')], requires=['screens'], oneshot=True),
+        Service('broken', [stub('broken', 'exit 3')], oneshot=True),
+        Service('after-broken', [stub('after-broken')], requires=['broken'], oneshot=True),
+    ]
+    supervisor, results = start(services, proc_dir, tmp_path)
+
+    ran = stub.ran()
+    assert sorted(ran) == ['broken', 'screens', 'wallpaper']
+    assert ran.index('screens') < ran.index('wallpaper')
+    assert results['screens'][0] == results['wallpaper'][0] == 'done'
+    assert results['broken'][:3:2] == ('failed', 'exit status 3')
+    assert results['after-broken'][:3:2] == ('skipped', 'requires broken')
+    with open(supervisor.report_path) as f:
+        assert 'after-broken' in f.read()
+
+
+def test_missing_binary_and_readiness(proc_dir, stub, tmp_path):
+    async def never():
+        return False
+
+    services = [
+        Service('missing', [str(tmp_path / 'bin' / 'missing')]),
+        Service('clipboard', [stub('parcellite')]),
+        Service('tray', [stub('tray')], ready=never, ready_timeout=0.2),
+    ]
+    _, results = start(services, proc_dir, tmp_path)
+
+    assert results['missing'][0] == 'failed'
+    assert results['clipboard'][0] == 'started'
+    assert results['tray'][:3:2] == ('failed', 'not ready after 0s')
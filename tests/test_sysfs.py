@@ -0,0 +1,116 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sysfs import BacklightLevel, BatteryIntervals, BatteryState, read_battery  # noqa: E402
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+    def write(path, value):
+        path = tmp_path / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('{}\n'.format(value))
+    write.root = str(tmp_path)
+    return write
+
+
+def battery(sysfs, name='BAT0', **values):
+    sysfs('class/power_supply/{}/type'.format(name), 'Battery')
+    for key, value in values.items():
+        sysfs('class/power_supply/{}/{}'.format(name, key), value)
+
+
+def test_read_battery_from_energy(sysfs):
+    battery(sysfs, status='Discharging', energy_now=30000000, energy_full=60000000,
+            power_now=10000000)
+    sysfs('class/power_supply/AC/type', 'Mains')
+    sysfs('class/power_supply/AC/online', 0)
+
+    assert read_battery(sysfs.root) == BatteryState('Discharging', 0.5, 3.0, 10.0, False)
+
+
+def test_read_battery_from_charge(sysfs):
+    battery(sysfs, status='Charging', charge_now=1000000, charge_full=4000000,
+            current_now=1500000, voltage_now=12000000)
+    sysfs('class/power_supply/AC/type', 'Mains')
+    sysfs('class/power_supply/AC/online', 1)
+
+    state = read_battery(sysfs.root)
+    assert state.percent == 0.25
+    assert state.hours == 2.0
+    assert state.watt == pytest.approx(18.0)
+    assert state.on_ac
+
+
+def test_read_battery_falls_back_to_capacity(sysfs):
+    battery(sysfs, status='Full', capacity=97)
+
+    state = read_battery(sysfs.root)
+    assert (state.percent, state.hours, state.watt) == (0.97, None, None)
+    # Without a Mains supply only discharging means off AC.
+    assert state.on_ac
+
+
+def test_read_battery_by_name_and_missing(sysfs):
+    battery(sysfs, name='BAT0', status='Discharging', capacity=10)
+    battery(sysfs, name='BAT1', status='Charging', capacity=60)
+
+    assert read_battery(sysfs.root, 'BAT1').status == 'Charging'
+    assert read_battery(sysfs.root, 'BAT2') is None
+    assert read_battery(os.path.join(sysfs.root, 'missing')) is None
+
+
+def test_intervals_switch_between_fast_normal_and_slow():
+    intervals = BatteryIntervals(interval=60, slow=300, fast=2, fast_reads=2)
+    discharging = BatteryState('Discharging', 0.5, 3.0, 10.0, False)
+    charging = BatteryState('Charging', 0.5, 1.0, 10.0, True)
+    full = BatteryState('Full', 1.0, None, None, True)
+
+    assert intervals.next(None, discharging) == 60
+    assert intervals.next(discharging, charging) == 2
+    assert intervals.next(charging, charging) == 2
+    assert intervals.next(charging, charging) == 60
+    assert intervals.next(charging, full) == 2
+    assert intervals.next(full, full) == 2
+    assert intervals.next(full, full) == 300
+    assert intervals.next(full, None) == 60
+
+
+def test_intervals_read_fast_after_a_uevent():
+    intervals = BatteryIntervals(interval=60, fast=2, fast_reads=1)
+    state = BatteryState('Discharging', 0.5, 3.0, 10.0, False)
+
+    intervals.changed()
+    assert intervals.next(state, state) == 2
+    assert intervals.next(state, state) == 60
+
+
+def test_backlight_target_is_clamped():
+    level = BacklightLevel(min_brightness=5)
+    level.read(0.5)
+    level.start_burst()
+
+    assert level.target(20) == 70
+    assert level.target(80) == 100
+    assert level.target(-60) == 5
+    assert level.end_burst(-10) == 40
+    assert level.burst_start is None
+
+
+def test_backlight_steps_from_applied_target_until_read():
+    level = BacklightLevel()
+    level.read(0.5)
+    level.start_burst()
+    level.applied = level.end_burst(10) / 100
+
+    level.start_burst()
+    assert level.end_burst(10) == 70
+
+    level.read(0.6)
+    assert level.applied is None
+    level.start_burst()
+    assert level.end_burst(10) == 70